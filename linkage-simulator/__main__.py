@@ -92,6 +92,18 @@ def testcase_click(bars: int = 6):
     frames = None
     return driver, frames, False
 
+def testcase_snake_click(bars: int = 300):
+    linkage = OpenLinkage(
+        link_sizes=[0.05 for i in range(bars)],
+        link_angles=[0.01 for i in range(bars)]
+    )
+    path_provider = ClickTargetProvider(linkage.last_endpoint())
+    controller = FABRIKLinkageController(iterations=20)
+
+    driver = LinkageDriver(linkage, path_provider, controller)
+    frames = None
+    return driver, frames, False
+
 def testcase_constraint():
     # A "box" linkage
     linkage = LinkageNetwork(
@@ -259,7 +271,7 @@ def test_rectification():
     # changes = network2.rectify()
     # assert np.allclose(changes, [0, 0, 0, 0])
 
-    network2.distance_constraints[0] = (0, 1, 1.05)
+    network2.distance_lengths[0] = 1.05
     changes = network2.rectify()
     assert np.allclose(changes, np.array([[0], [0], [0.05], [0]]))
     print("After rectification", network2.nodes)
@@ -0,0 +1,98 @@
+from math import atan2, cos, sin, hypot
+from typing import List, Sequence
+
+import numpy as np
+
+from .LinkageController import *
+from .DifferentialKinematicOpenLinkageController import SolveDiagnostics
+
+class CCDLinkageController(LinkageController):
+    """Cyclic coordinate descent inverse kinematics.
+
+    Each sweep walks from the last joint to the first, rotating every joint
+    so the end effector swings towards the target. Rotating a joint doesn't
+    move the joints before it, so a sweep only needs the joint positions
+    from the start of the sweep and a running end effector position: O(n)
+    per sweep with no jacobian.
+    """
+
+    def __init__(self, iterations: int = 10, tolerance: float = 1e-4) -> None:
+        """Create a CCD controller.
+
+        Args:
+            iterations (int): Maximum number of sweeps per update
+            tolerance (float): End effector error at which to stop
+        """
+        self.iterations = iterations
+        self.tolerance = tolerance
+        self.last_diagnostics = None
+
+    def update(self, linkage: OpenLinkage, target: np.array):
+        tx, ty = target
+        links = linkage.links
+        mins, maxs = linkage.link_minangles, linkage.link_maxangles
+        angles = list(linkage.angles)
+
+        points = linkage.endpoints()
+        xs, ys = points[:, 0].tolist(), points[:, 1].tolist()
+        ex, ey = xs[-1], ys[-1]
+        error = hypot(tx - ex, ty - ey)
+
+        diagnostics = SolveDiagnostics()
+        while error >= self.tolerance and diagnostics.iterations < self.iterations:
+            diagnostics.iterations += 1
+
+            for i in reversed(range(len(links))):
+                px, py = xs[i], ys[i]
+                desired = atan2(ty - py, tx - px) - atan2(ey - py, ex - px)
+                angle = OpenLinkage.Helpers.nearest_angle(angles[i] + desired, angles[i])
+                angle = min(max(angle, mins[i]), maxs[i])
+                delta, angles[i] = angle - angles[i], angle
+
+                # Swing the end effector about joint i
+                c, s = cos(delta), sin(delta)
+                rx, ry = ex - px, ey - py
+                ex, ey = px + c * rx - s * ry, py + s * rx + c * ry
+
+                error = hypot(tx - ex, ty - ey)
+                if error < self.tolerance:
+                    break
+
+            CCDLinkageController._forward_kinematics(links, angles, xs, ys)
+            ex, ey = xs[-1], ys[-1]
+            error = hypot(tx - ex, ty - ey)
+
+        linkage.set_angles(angles)
+        diagnostics.error = error
+        diagnostics.converged = error < self.tolerance
+        self.last_diagnostics = diagnostics
+
+    def meets_target(self, linkage: OpenLinkage, target: np.array) -> bool:
+        return OpenLinkage.Helpers.dist(linkage.last_endpoint(), target) < self.tolerance
+
+    @staticmethod
+    def _forward_kinematics(links: Sequence[float], angles: Sequence[float], xs: List[float], ys: List[float]):
+        """Recomputes the joint positions in place, keeping the base joint"""
+        x, y, absolute = xs[0], ys[0], 0.0
+        for i, (length, angle) in enumerate(zip(links, angles)):
+            absolute += angle
+            x += length * cos(absolute)
+            y += length * sin(absolute)
+            xs[i + 1], ys[i + 1] = x, y
+
+if __name__ == "__main__":
+
+    bars = 200
+    snake = OpenLinkage([0.05] * bars, [0.01] * bars)
+    controller = CCDLinkageController(iterations=50)
+
+    for target in [(3, 4), (-2, 1), (-1.5, -1)]:
+        target = np.array(target)
+        controller.update(snake, target)
+        print(target, controller.last_diagnostics)
+        assert controller.meets_target(snake, target)
+
+    limited = OpenLinkage([1, 1, 1], [0.2, 0.2, 0.2], link_minangles=-0.5, link_maxangles=0.5)
+    controller.update(limited, np.array((-1, 1)))
+    assert all(-0.5 <= a <= 0.5 for a in limited.angles)
+    assert not controller.last_diagnostics.converged
@@ -1,27 +1,162 @@
+import math
+import weakref
+from dataclasses import dataclass
+from typing import Callable, Literal, Tuple, Union
+
 import scipy.linalg
 import matplotlib.artist
 
 from .LinkageController import *
+from .DifferentialKinematicOpenLinkageController import SolveDiagnostics
+
+@dataclass
+class DragState:
+    """What ConstraintController carries from one frame to the next for a
+    network. Only valid while the network's topology_version is unchanged."""
+    topology_version: int
+    component: Union[int, None] = None  # Component dragged last frame
+    # Factorization of the component's jacobian from a recent frame
+    factorization: Union[ConstraintFactorization, None] = None
+    # (N, 2) second order part of last frame's motion: everything but the
+    # projected action, i.e. what correcting the constraints took
+    correction: Union[np.ndarray, None] = None
+    step: float = 0.0                   # Length of last frame's action
+    multipliers: Union[np.ndarray, None] = None  # Last "cg" multipliers
+    multipliers_component: Union[int, None] = None
+    factorizations: int = 0             # Factorizations made so far
 
 class ConstraintController(LinkageController):
 
+    Projection = Literal["svd", "cg"]
+
+    def __init__(self, 
+        projection: Projection = "svd", 
+        cg_tolerance: float = 1e-8, 
+        cg_max_iterations: Union[int, None] = None,
+        tolerance: float = 1e-4,
+        warm_start: bool = True,
+        refactorize_tolerance: float = 3e-2
+    ) -> None:
+        """Create a constraint controller.
+
+        Args:
+            projection (str): How actions are projected onto the nullspace
+                of the constraints. "svd" factorizes the jacobian once per
+                frame (see LinkageNetwork.factorize_constraints): a dense SVD
+                for small components, a sparse factorization of J J^T for
+                large ones. "cg" solves for the constraint multipliers with
+                conjugate gradients using only sparse products, keeping no
+                factors at all.
+            cg_tolerance (float): Relative residual at which "cg" stops
+            cg_max_iterations (int, optional): Iteration cap for "cg".
+                Defaults to the constraint count.
+            tolerance (float): Distance from the target, and largest
+                constraint error, at which the target is considered met
+            warm_start (bool): Reuse factorizations over several frames and
+                predict each frame's correction from the last one's (see
+                drag_state), rather than factorizing every frame. "cg"
+                multipliers are carried over either way.
+            refactorize_tolerance (float): With warm_start, a factorization
+                from an earlier frame is replaced once an action projected
+                with it violates the current constraints by more than this,
+                relative to its length, to first order
+        """
+        assert projection in ("svd", "cg")
+        self.projection = projection
+        self.cg_tolerance = cg_tolerance
+        self.cg_max_iterations = cg_max_iterations
+        self.tolerance = tolerance
+        self.warm_start = warm_start
+        self.refactorize_tolerance = refactorize_tolerance
+        self.last_projection = None
+        self._drag_states = weakref.WeakKeyDictionary()
+
+    def drag_state(self, linkage: LinkageNetwork) -> DragState:
+        """The state kept for a network across frames, reset whenever its
+        constraints have been replaced"""
+        state = self._drag_states.get(linkage)
+        if state is None or state.topology_version != linkage.topology_version:
+            state = DragState(topology_version=linkage.topology_version)
+            self._drag_states[linkage] = state
+        return state
+
     def update(self, linkage: Linkage, target: np.array):
         assert isinstance(linkage, LinkageNetwork)
-        
+        inode = linkage.nearest_node(target)
+
+        if linkage.xpbd is not None:
+            # Position based networks aren't projected: the dragged node goes
+            # straight to the target and is held there while the rest follows
+            self.perform_action(linkage, self.get_action(linkage, target))
+            linkage.rectify(tolerance=self.tolerance, pinned=(inode,))
+            return
+
+        # Only the connected component of the dragged node is affected
+        component = linkage.component_labels[inode]
+
+        # A crank or rocker of a component made only of four-bar loops is
+        # turned towards the target exactly, unless that is past a dead point
+        loop = linkage.four_bar_loop(inode)
+        if loop is not None and linkage.is_closed_form(component) and loop.drive(linkage, inode, target):
+            return
+
+        state = self.drag_state(linkage)
+        if state.component != component:
+            state.component = component
+            state.factorization = None
+            state.correction = None
+
+        # Otherwise a factorization of the component's jacobian is shared by
+        # the projection and the rectification that follows it. It is kept
+        # for later frames until rectify can't converge with it alone.
+        reused = self.projection == "svd" and state.factorization is not None
+        if self.projection == "svd" and state.factorization is None:
+            state.factorization = linkage.factorize_constraints(component)
+            state.factorizations += 1
+
         action = self.get_action(linkage, target)
-        action = self.project_onto_nullspace(linkage, action)
-        self.perform_action(linkage, action)
+        step = float(np.linalg.norm(action))
+        projected = self.project_onto_nullspace(linkage, action, state.factorization, component)
+        if reused:
+            # The current jacobian, applied to an action projected with an
+            # old factorization, shows how far off its nullspace has become.
+            # An action projected away entirely, as in a rigid component,
+            # shows nothing.
+            solver_action = linkage.to_solver(projected, component)
+            length = float(np.linalg.norm(solver_action))
+            leak = np.abs(linkage.solver_jacobian(component, sparse=True) @ solver_action).max(initial=0.0)
+            if length > 1e-9 * step and leak > self.refactorize_tolerance * length:
+                state.factorization = linkage.factorize_constraints(component)
+                state.factorizations += 1
+                projected = self.project_onto_nullspace(linkage, action, state.factorization, component)
+        factorization = state.factorization
+        self.perform_action(linkage, projected)
+        moved = linkage.nodes.copy()
+
+        # Predict the second order part of the motion from last frame's,
+        # scaled to this step. It is normal to the constraints, so unlike
+        # extrapolating the whole motion it doesn't carry momentum along
+        # the free directions of the network. Kept only if it helps.
+        if self.warm_start and state.correction is not None and state.step > 0:
+            residual = np.abs(linkage.constraint_errors()).max(initial=0.0)
+            linkage.move_nodes(state.correction * (step / state.step) ** 2)
+            if np.abs(linkage.constraint_errors()).max(initial=0.0) >= residual:
+                linkage.move_nodes(moved - linkage.nodes)
 
-        linkage.rectify()
+        linkage.rectify(factorization=factorization)
+
+        state.correction = linkage.nodes - moved
+        state.step = step
+        rectified = linkage.last_rectify
+        if not self.warm_start or rectified.iterations > rectified.factorization_steps or not rectified.converged:
+            state.factorization = None
         # self.move_randomly(linkage)
         
 
     def get_action(self, linkage: LinkageNetwork, target: np.array):
 
         # Find closest node to target
-        nodes_to_examine = (i for i in range(linkage.node_count)
-        if not linkage.is_fixed_node(i))
-        inode = min(nodes_to_examine, key=lambda i: np.linalg.norm(linkage.nodes[i] - target))
+        inode = linkage.nearest_node(target)
 
         # Move that node to the target
         dx, dy = target - linkage.nodes[inode]
@@ -47,38 +182,147 @@ class ConstraintController(LinkageController):
 
     def perform_action(self, linkage: LinkageNetwork, action: np.array):
         assert len(action) == len(linkage.nodes) * 2
-        for node_i in range(len(linkage.nodes)):
-            dx = action[node_i * 2]
-            dy = action[node_i * 2 + 1]
-            linkage.nodes[node_i] += np.array((dx, dy))
+        linkage.move_nodes(np.reshape(action, (-1, 2)))
     
-    def project_onto_nullspace(self, linkage: LinkageNetwork, action: np.array):
+    def project_onto_nullspace(
+        self,
+        linkage: LinkageNetwork,
+        action: np.array,
+        factorization: Union[ConstraintFactorization, None] = None,
+        component: Union[int, None] = None
+    ):
+        """Removes the part of the action that would violate the constraints.
 
-        # See MIT Open Courseware Notes
-        # https://www.google.com/url?sa=t&rct=j&q=&esrc=s&source=web&cd=&ved=2ahUKEwjYq8nYop7tAhVGmlkKHcDPCg0QFjADegQIBBAC&url=https%3A%2F%2Focw.mit.edu%2Fcourses%2Fmathematics%2F18-06sc-linear-algebra-fall-2011%2Fleast-squares-determinants-and-eigenvalues%2Fprojections-onto-subspaces%2FMIT18_06SCF11_Ses2.2sum.pdf&usg=AOvVaw3oq76vH3jA3ASrjLdgMJHK
+        The projection onto the nullspace of the jacobian J is (I - J+ J),
+        applied through the factorization of J rather than as an explicit
+        variable_count x variable_count matrix.
 
-        # If A is a basis for the plane we want to project to:
-        # Projection Matrix:  = A* (A^T*A)-1*A^t
-        jacobian = linkage.constraint_jacobian()
-        nullspace = scipy.linalg.null_space(jacobian)
+        The projection works on the network's solver variables (see
+        LinkageNetwork.solver_jacobian), so in reduced coordinates the fixed
+        nodes' entries come back as zeros.
+
+        Args:
+            factorization (ConstraintFactorization, optional): Factorization
+                of the current jacobian, if already computed this frame
+            component (int, optional): Only project, and keep, the part of the
+                action in this connected component. Taken from the
+                factorization if one is given.
+        """
+        if factorization is not None:
+            component = factorization.component
+
+        action = linkage.to_solver(action, component)
+        if factorization is None and self.projection == "cg":
+            action = self.project_matrix_free(linkage, action, component)
+        else:
+            if factorization is None:
+                factorization = linkage.factorize_constraints(component)
+            action = factorization.project_onto_nullspace(action)
+
+        return linkage.from_solver(action, component)
+
+    def project_matrix_free(self, linkage: LinkageNetwork, action: np.array, component: Union[int, None] = None) -> np.ndarray:
+        """Computes a - J^T (J J^T)^-1 J a using only sparse products.
+
+        The multipliers (J J^T)^-1 J a are found with conjugate gradients,
+        starting from the previous call's multipliers for this network (see
+        drag_state), so memory scales with
+        the constraint count and dragging smoothly needs few iterations.
+        The outcome is recorded in `last_projection`.
 
-        A = nullspace
+        Args:
+            action (np.array): action over the solver variables of the
+                network, or of one component
+            component (int, optional): connected component to project within
+        """
+        jacobian = linkage.solver_jacobian(component, sparse=True)
+        jacobian_t = jacobian.T.tocsr()
 
-        paren = np.linalg.inv(np.matmul(A.T, A))
-        proj_matrix = np.matmul(A, paren)
-        proj_matrix = np.matmul(proj_matrix, A.T)
+        rhs = jacobian @ action
+        state = self.drag_state(linkage)
+        if state.multipliers is None or state.multipliers_component != component or len(state.multipliers) != len(rhs):
+            state.multipliers = np.zeros(len(rhs))
+            state.multipliers_component = component
 
-        proj_action = np.matmul(proj_matrix, action)
-        return proj_action
+        max_iterations = self.cg_max_iterations
+        if max_iterations is None:
+            max_iterations = len(rhs)
+
+        state.multipliers, iterations, residual = ConstraintController.conjugate_gradient(
+            lambda v: jacobian @ (jacobian_t @ v), rhs, state.multipliers, self.cg_tolerance, max_iterations
+        )
+        self.last_projection = SolveDiagnostics(
+            iterations=iterations,
+            error=residual,
+            converged=residual <= self.cg_tolerance
+        )
+        return action - jacobian_t @ state.multipliers
+
+    @staticmethod
+    def conjugate_gradient(
+        apply: Callable[[np.ndarray], np.ndarray],
+        rhs: np.ndarray,
+        x0: np.ndarray,
+        tolerance: float,
+        max_iterations: int
+    ) -> Tuple[np.ndarray, int, float]:
+        """Solves A x = rhs for a symmetric positive (semi)definite A.
+
+        Args:
+            apply: function computing A @ v
+            rhs (np.ndarray): right hand side, in the range of A
+            x0 (np.ndarray): initial guess
+            tolerance (float): relative residual |rhs - A x| / |rhs| to stop at
+            max_iterations (int): most iterations to take
+
+        Returns:
+            Tuple[np.ndarray, int, float]: solution, iterations taken and
+                final relative residual
+        """
+        rhs_norm = np.linalg.norm(rhs)
+        if rhs_norm == 0:
+            return np.zeros_like(rhs), 0, 0.0
+
+        x = np.array(x0, float)
+        residual = rhs - apply(x)
+        direction = residual.copy()
+        residual_sq = residual @ residual
+
+        iterations = 0
+        while math.sqrt(residual_sq) > tolerance * rhs_norm and iterations < max_iterations:
+            a_direction = apply(direction)
+            curvature = direction @ a_direction
+            if curvature <= 0:
+                # Only possible once the residual has left the range of A
+                break
+
+            step = residual_sq / curvature
+            x += step * direction
+            residual -= step * a_direction
+
+            new_residual_sq = residual @ residual
+            direction *= new_residual_sq / residual_sq
+            direction += residual
+            residual_sq = new_residual_sq
+            iterations += 1
+
+        return x, iterations, math.sqrt(residual_sq) / rhs_norm
 
     def meets_target(self, linkage: Linkage, target: np.array) -> bool:
+        """Whether the node being dragged has reached the target, with every
+        constraint still satisfied"""
         assert isinstance(linkage, LinkageNetwork)
-        raise NotImplemented()
+        inode = linkage.nearest_node(target)
+        return np.linalg.norm(linkage.nodes[inode] - target) <= self.tolerance \
+            and linkage.satisfies_all_constraints(self.tolerance)
 
     def draw(self, ax, cached) -> List[matplotlib.artist.Artist]:
         return []
 
 if __name__ == "__main__":
+
+    from ..model.LinkageNetwork import lattice_network
+
     test_network = LinkageNetwork(
         nodes = [
             (0, 0),
@@ -107,6 +351,102 @@ if __name__ == "__main__":
     controller = ConstraintController()
     controller.update(test_network, np.array([1.01, 0]))
     print(test_network)
+    assert not controller.meets_target(test_network, np.array([1.01, 0]))
+    for _ in range(20):
+        controller.update(test_network, np.array([0.6, 0.8]))
+    assert controller.meets_target(test_network, np.array([0.6, 0.8]))
+
+    # Conjugate gradient projection matches the factorized projection on a
+    # lattice with a fixed left column
+    lattice = lattice_network(12, 12)
+    corner = lattice.node_count - 1
+    action = np.random.uniform(-1, 1, lattice.variable_count)
+    cg_controller = ConstraintController(projection="cg", cg_tolerance=1e-12)
+    projected = cg_controller.project_onto_nullspace(lattice, action)
+    assert cg_controller.last_projection.converged
+    assert np.allclose(projected, controller.project_onto_nullspace(lattice, action))
+
+    # The next projection starts from the previous multipliers
+    cg_controller.project_onto_nullspace(lattice, action)
+    assert cg_controller.last_projection.iterations == 0
+
+    target = lattice.nodes[corner] + (0.1, 0.1)
+    cg_controller.update(lattice, target)
+    assert lattice.last_rectify.converged
+
+    # Eliminating the fixed nodes projects the same way
+    lattice.reduced_coordinates = True
+    for projector in (controller, ConstraintController(projection="cg", cg_tolerance=1e-12)):
+        reduced_projected = projector.project_onto_nullspace(lattice, action)
+        lattice.reduced_coordinates = False
+        assert np.allclose(reduced_projected, projector.project_onto_nullspace(lattice, action))
+        lattice.reduced_coordinates = True
+
+    # Independent mechanisms are separate components; dragging one leaves
+    # the others alone
+    pair = LinkageNetwork(
+        nodes=[(0, 0), (1, 0), (5, 0), (6, 0)],
+        distance_constraints=[(0, 1, 1), (2, 3, 1)],
+        fixed_constraints=[(0, (0, 0)), (2, (5, 0))],
+        bounds=(-2, 8, -2, 2)
+    )
+    assert pair.component_count == 2 and np.array_equal(pair.component_labels, [0, 0, 1, 1])
+    for _ in range(20):
+        controller.update(pair, np.array([0.6, 0.8]))
+    assert controller.meets_target(pair, np.array([0.6, 0.8]))
+    assert np.allclose(pair.nodes[2:], [(5, 0), (6, 0)])
+
+    # Four-bar loops are dragged in closed form, by the crank or the rocker,
+    # and by the least squares projection up to the dead points
+    four_bar = LinkageNetwork(
+        nodes=[(0, 0), (0, 1), (2, 1), (2, 0)],
+        distance_constraints=[(0, 1, 1), (1, 2, 2), (2, 3, 1)],
+        fixed_constraints=[(0, (0, 0)), (3, (2, 0))],
+        bounds=(-2, 4, -2, 3)
+    )
+    target = np.array((-0.6, 0.8))
+    controller.update(four_bar, target)
+    assert controller.meets_target(four_bar, target)
+    assert np.allclose(four_bar.nodes[2], (1.4, 0.8))
+    controller.update(four_bar, np.array((4.0, 0.0)))
+    assert four_bar.satisfies_all_constraints(tolerance=1e-12)
+
+    # A network using the position based solver is dragged without projecting
+    lattice.reduced_coordinates = False
+    lattice.xpbd = XPBDSolver(iterations=500)
+    target = lattice.nodes[corner] + (-0.1, -0.1)
+    for _ in range(10):
+        controller.update(lattice, target)
+    assert controller.meets_target(lattice, target)
+
+    # Warm starting reuses factorizations across frames of a drag, and ends
+    # up where starting each frame from scratch does
+    dragged = {}
+    for warm_start in (False, True):
+        network = lattice_network(10, 10, braces=3)
+        corner = network.nodes[-1].copy()
+        drag_controller = ConstraintController(warm_start=warm_start)
+        for angle in np.linspace(0, np.pi, 60):
+            drag_controller.update(network, corner + 0.3 * np.array((math.cos(angle) - 1, math.sin(angle))))
+            assert network.last_rectify.converged
+        dragged[warm_start] = (network.nodes.copy(), drag_controller.drag_state(network).factorizations)
+    assert dragged[True][1] < dragged[False][1] / 3
+    assert np.abs(dragged[True][0] - dragged[False][0]).max() < 0.05
+
+    # Replacing the constraints discards the state kept for a network
+    state = drag_controller.drag_state(network)
+    assert state.factorization is not None
+    network.distance_constraints = network.distance_constraints[:-1]
+    assert drag_controller.drag_state(network).factorization is None
+
+    # "cg" multipliers are carried over between frames even without warm
+    # starting
+    cold_cg = ConstraintController(projection="cg", cg_tolerance=1e-12, warm_start=False)
+    action = np.random.uniform(-1, 1, network.variable_count)
+    cold_cg.project_onto_nullspace(network, action)
+    assert cold_cg.last_projection.iterations > 0
+    cold_cg.project_onto_nullspace(network, action)
+    assert cold_cg.last_projection.iterations == 0
     # controller.
 
         
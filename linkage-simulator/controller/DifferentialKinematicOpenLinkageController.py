@@ -1,60 +1,351 @@
 
 import math
-from typing import Literal, Union
+import time
+from dataclasses import dataclass
+from typing import Literal, Tuple, Union
 import numpy as np
 from math import pi, sin, cos
 
-from .LinkageController import OpenLinkage, LinkageController
+from .LinkageController import OpenLinkage, OpenLinkageBatch, LinkageController
+
+@dataclass
+class SolveDiagnostics:
+    iterations: int = 0
+    error: float = math.inf
+    damped_iterations: int = 0
+    converged: bool = False
+    # Trial steps undone for increasing the error, not counted in iterations
+    rejected_steps: int = 0
 
 class DifferentialKinematicOpenLinkageController(LinkageController):
 
-    def __init__(self, max_movement = 1e6, iterations = 1) -> None:
+    Solver = Literal["lstsq", "normal", "damped"]
+
+    # Default iterations per update of the "damped" solver. The others take
+    # one step per update by default.
+    DAMPED_ITERATIONS = 20
+
+    def __init__(self, 
+        max_movement = 1e6, 
+        iterations: Union[int, None] = None, 
+        solver: Solver = "lstsq", 
+        max_condition: float = 1e4,
+        tolerance: float = 1e-4,
+        damping: float = 0.05,
+        time_budget: Union[float, None] = None,
+    ) -> None:
+        """Create a differential kinematics controller.
+
+        Args:
+            max_movement (float): Largest angle change (norm) applied per iteration
+            iterations (int, optional): Solver iterations per update. For the
+                "damped" solver this is the maximum number of accepted steps;
+                it stops early once within tolerance, and rejected trial
+                steps don't count. Defaults to 1, or DAMPED_ITERATIONS for
+                the "damped" solver.
+            solver (str): "lstsq" solves every step with an SVD based least
+                squares. "normal" inverts the 2x2 matrix J*J^T in closed form,
+                falling back to the SVD when J is close to singular. "damped"
+                is a Levenberg-Marquardt style damped least squares.
+            max_condition (float): Condition number of J above which the
+                "normal" solver falls back to the SVD, and the "damped" solver
+                always applies damping
+            tolerance (float): End effector error at which the target is met
+            damping (float): Smallest damping factor used by the "damped" solver
+            time_budget (float, optional): Seconds the "damped" solver may
+                spend per update
+        """
         self.max_movement = max_movement
+        if iterations is None:
+            iterations = DifferentialKinematicOpenLinkageController.DAMPED_ITERATIONS if solver == "damped" else 1
         self.iterations = iterations
-        pass
+        self.solver = solver
+        self.max_condition = max_condition
+        self.tolerance = tolerance
+        self.damping = damping
+        self.time_budget = time_budget
+
+        # Rank & condition number of the jacobian(s) seen by the last solve
+        self.last_rank = None
+        self.last_condition_number = None
+        self.last_diagnostics = None
 
     def update(self, linkage: OpenLinkage, target: np.array):
 
+        if isinstance(linkage, OpenLinkageBatch):
+            self.update_batch(linkage, target)
+            return
+
+        if self.solver == "damped":
+            self.solve_damped(linkage, target)
+            return
+
         for _ in range(self.iterations):
-            dx, dy = target - linkage.last_endpoint()
+            points = linkage.endpoints()
+            dx, dy = target - points[-1]
             
-            solution, residuals, rank, s = self.get_solution(linkage, dx, dy)
+            solution, residuals, rank, s = self.get_solution(linkage, dx, dy, linkage.jacobian(points))
             
             if rank < 2:
                 print("ALERT! Singular config")
 
-            solution_norm = np.linalg.norm(solution)
+            linkage.move_angles(self._clamp_movement(solution))
 
-            if solution_norm > self.max_movement:
-                solution = solution / solution_norm * self.max_movement
-            
+    def solve_damped(self, 
+        linkage: OpenLinkage, 
+        target: np.ndarray, 
+        max_iterations: Union[int, None] = None, 
+        time_budget: Union[float, None] = None
+    ) -> SolveDiagnostics:
+        """Moves the linkage towards the target with damped least squares.
+
+        Steps are solved undamped while they keep reducing the error. A step
+        that increases the error is undone and retried with more damping, and
+        the damping is relaxed again after each successful step. Steps taken
+        near a singular configuration are always damped. Only accepted steps
+        count as iterations; retries stop once the damping grows 1e4 times
+        past self.damping, or the time budget runs out.
+
+        Args:
+            linkage (OpenLinkage): Linkage to move
+            target (np.ndarray): Target for the end effector
+            max_iterations (int, optional): Overrides self.iterations, the most
+                accepted steps, for this call
+            time_budget (float, optional): Overrides self.time_budget for this call
+
+        Returns:
+            SolveDiagnostics: Accepted steps, final error, the number of
+                accepted steps that were damped and the rejected steps
+        """
+        max_iterations = self.iterations if max_iterations is None else max_iterations
+        time_budget = self.time_budget if time_budget is None else time_budget
+        deadline = None if time_budget is None else time.perf_counter() + time_budget
+
+        diagnostics = SolveDiagnostics()
+        points = linkage.endpoints()
+        dx, dy = target - points[-1]
+        error = math.hypot(dx, dy)
+        damping = 0.0
+
+        while error >= self.tolerance and diagnostics.iterations < max_iterations:
+            if deadline is not None and time.perf_counter() > deadline:
+                break
+
+            jx, jy, a, b, c, s_max, s_min = self._normal_matrix(linkage.jacobian(points))
+            self.last_rank = 2 if s_min > np.finfo(float).eps * linkage.link_count * s_max else 1
+            self.last_condition_number = s_max / s_min if s_min > 0 else math.inf
+
+            if s_min * self.max_condition <= s_max:
+                damping = max(damping, self.damping)
+
+            # Solve (J J^T + damping^2 I) m = dX, then dtheta = J^T m
+            a, c = a + damping * damping, c + damping * damping
+            det = a * c - b * b
+            if det <= 0:
+                # Only possible if every link has zero length
+                break
+            mx = (c * dx - b * dy) / det
+            my = (a * dy - b * dx) / det
+            solution = self._clamp_movement(jx * mx + jy * my)
+
+            previous_angles = np.array(linkage.angles)
             linkage.move_angles(solution)
+            new_points = linkage.endpoints()
+            new_dx, new_dy = target - new_points[-1]
+            new_error = math.hypot(new_dx, new_dy)
 
-    def get_solution(self, linkage: OpenLinkage, dx: float, dy: float):
-        jacobian = self.compute_jacobian(linkage)
-        dX = np.array((dx, dy))
-        return np.linalg.lstsq(jacobian, dX, rcond=None) 
+            if new_error < error:
+                diagnostics.iterations += 1
+                if damping > 0:
+                    diagnostics.damped_iterations += 1
+                stalled = error - new_error < 1e-9 * error
+                points, dx, dy, error = new_points, new_dx, new_dy, new_error
+                damping = 0.0 if damping <= self.damping else damping / 2
+                if stalled:
+                    break
+            else:
+                linkage.set_angles(previous_angles)
+                diagnostics.rejected_steps += 1
+                damping = max(damping * 4, self.damping)
+                if damping > self.damping * 1e4:
+                    # Steps no longer make progress (e.g. target out of reach)
+                    break
 
-    def meets_target(self, linkage: OpenLinkage, target: np.array) -> bool:
-        return OpenLinkage.Helpers.dist(linkage.last_endpoint(), target) < 1e-4
+        diagnostics.error = error
+        diagnostics.converged = error < self.tolerance
+        self.last_diagnostics = diagnostics
+        return diagnostics
 
-    def compute_jacobian(self, linkage: OpenLinkage):
+    def _clamp_movement(self, solution: np.ndarray) -> np.ndarray:
+        solution_norm = np.linalg.norm(solution)
+        if solution_norm > self.max_movement:
+            return solution / solution_norm * self.max_movement
+        return solution
+
+    def update_batch(self, batch: OpenLinkageBatch, targets: np.ndarray):
+        """Steps every linkage in the batch towards its target at once.
+
+        Args:
+            batch (OpenLinkageBatch): Linkages to move
+            targets (np.ndarray): (batch, 2) targets, or a single (2,) target
+                shared by the whole batch
+        """
+        for _ in range(self.iterations):
+            points = batch.endpoints()
+            dX = np.broadcast_to(targets, (batch.batch_size, 2)) - points[:, -1]
+
+            solutions, ranks, singulars = self.get_batch_solution(batch, dX, batch.jacobian(points))
+
+            solution_norms = np.linalg.norm(solutions, axis=1, keepdims=True)
+            too_far = solution_norms > self.max_movement
+            solutions = np.where(
+                too_far,
+                solutions / np.where(too_far, solution_norms, 1) * self.max_movement,
+                solutions
+            )
+
+            batch.move_angles(solutions)
+
+    def get_batch_solution(self, batch: OpenLinkageBatch, dX: np.ndarray, jacobians: Union[np.ndarray, None] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Solves J * dtheta = dX for every linkage in the batch.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, np.ndarray]: (batch, links) solutions,
+                (batch,) ranks and (batch, 2) singular values
+        """
+        if jacobians is None:
+            jacobians = batch.jacobian()
+
+        if self.solver == "damped" and batch.link_count >= 2:
+            # Batches use a fixed damping; adaptive damping is per linkage only
+            solutions, singulars, _ = self.solve_normal_equations(jacobians, dX, self.damping)
+            cutoff = np.finfo(float).eps * batch.link_count * singulars[:, 0]
+            ranks = 1 + (singulars[:, 1] > cutoff)
+        elif self.solver == "normal" and batch.link_count >= 2:
+            solutions, singulars, well_conditioned = self.solve_normal_equations(jacobians, dX)
+            ranks = np.full(batch.batch_size, 2)
+
+            singular = ~well_conditioned
+            if singular.any():
+                solutions[singular], ranks[singular], singulars[singular] = \
+                    self.solve_svd(jacobians[singular], dX[singular])
+        else:
+            solutions, ranks, singulars = self.solve_svd(jacobians, dX)
+
+        self._record_conditioning(ranks, singulars)
+        return solutions, ranks, singulars
+
+    def get_solution(self, linkage: OpenLinkage, dx: float, dy: float, jacobian: Union[np.ndarray, None] = None):
+        """Solves J * dtheta = (dx, dy) in the least squares sense.
+
+        Returns:
+            Same as np.linalg.lstsq: (solution, residuals, rank, singular values)
+        """
+        if jacobian is None:
+            jacobian = self.compute_jacobian(linkage)
+
+        if self.solver == "normal" and linkage.link_count >= 2:
+            jx, jy, a, b, c, s_max, s_min = self._normal_matrix(jacobian)
+
+            if s_min * self.max_condition > s_max:
+                det = a * c - b * b
+                mx = (c * dx - b * dy) / det
+                my = (a * dy - b * dx) / det
+                self.last_rank = 2
+                self.last_condition_number = s_max / s_min
+                return jx * mx + jy * my, np.empty(0), 2, np.array((s_max, s_min))
 
-        clinks = len(linkage.angles)
+        solution, residuals, rank, singulars = np.linalg.lstsq(jacobian, np.array((dx, dy)), rcond=None)
+        self._record_conditioning(rank, singulars)
+        return solution, residuals, rank, singulars
 
-        x_factors = [
-            -linkage.links[i] * sin(sum(linkage.angles[0:i+1]))
-            for i in range(clinks)
-        ]
-        y_factors = [
-            linkage.links[i] * cos(sum(linkage.angles[0:i+1]))
-            for i in range(clinks)
-        ]
+    @staticmethod
+    def _normal_matrix(jacobian: np.ndarray) -> Tuple[np.ndarray, np.ndarray, float, float, float, float, float]:
+        """Splits a single 2 x n jacobian into its rows, the entries [[a, b], [b, c]]
+        of J J^T and the largest & smallest singular values of J.
+        """
+        jx, jy = jacobian
+        a, b, c = jx.dot(jx), jx.dot(jy), jy.dot(jy)
 
-        return np.array([
-            [sum(x_factors[-clinks + i:]) for i in range(0, clinks)],
-            [sum(y_factors[-clinks + i:]) for i in range(0, clinks)]
-        ])
+        # Eigenvalues of J J^T are the squared singular values of J. The
+        # smaller one is taken from the determinant to avoid cancellation.
+        eig_max = (a + c) / 2 + math.sqrt(((a - c) / 2) ** 2 + b * b)
+        eig_min = max(a * c - b * b, 0.0) / eig_max if eig_max > 0 else 0.0
+        return jx, jy, a, b, c, math.sqrt(eig_max), math.sqrt(eig_min)
+
+    def solve_normal_equations(self, jacobian: np.ndarray, dX: np.ndarray, damping: float = 0.0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Minimum norm solution dtheta = J^T (J J^T + damping^2 I)^-1 dX, with
+        the 2x2 inverse and the singular values of J computed in closed form.
+        Vectorized counterpart of the "normal" path in get_solution.
+
+        Args:
+            jacobian (np.ndarray): (..., 2, links) jacobian(s)
+            dX (np.ndarray): (..., 2) desired end effector movement(s)
+            damping (float): Damping factor. With damping > 0 every solution
+                is considered trustworthy.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, np.ndarray]: (..., links) solutions,
+                (..., 2) singular values of J, and a (...) mask of the
+                jacobians that were well conditioned enough to trust the solution.
+        """
+        jx, jy = jacobian[..., 0, :], jacobian[..., 1, :]
+        a = np.einsum('...i,...i->...', jx, jx)
+        b = np.einsum('...i,...i->...', jx, jy)
+        c = np.einsum('...i,...i->...', jy, jy)
+        det = a * c - b * b
+
+        # Eigenvalues of J J^T are the squared singular values of J. The
+        # smaller one is taken from the determinant to avoid cancellation.
+        eig_max = (a + c) / 2 + np.sqrt(((a - c) / 2) ** 2 + b * b)
+        eig_min = np.maximum(det, 0) / np.where(eig_max > 0, eig_max, 1)
+        singulars = np.sqrt(np.stack((eig_max, eig_min), axis=-1))
+
+        if damping > 0:
+            a, c = a + damping * damping, c + damping * damping
+            det = a * c - b * b
+            well_conditioned = det > 0
+        else:
+            well_conditioned = singulars[..., 1] * self.max_condition > singulars[..., 0]
+        det = np.where(well_conditioned, det, 1)
+
+        dx, dy = dX[..., 0], dX[..., 1]
+        mx = (c * dx - b * dy) / det
+        my = (a * dy - b * dx) / det
+        solution = jx * mx[..., np.newaxis] + jy * my[..., np.newaxis]
+        return solution, singulars, well_conditioned
+
+    @staticmethod
+    def solve_svd(jacobian: np.ndarray, dX: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Batched equivalent of np.linalg.lstsq(jacobian, dX, rcond=None).
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, np.ndarray]: (..., links) solutions,
+                (...) ranks and (..., k) singular values
+        """
+        u, singulars, vt = np.linalg.svd(jacobian, full_matrices=False)
+        cutoff = np.finfo(float).eps * max(jacobian.shape[-2:]) * singulars[..., :1]
+        kept = singulars > cutoff
+
+        inv_singulars = np.where(kept, 1 / np.where(kept, singulars, 1), 0)
+        coefficients = np.einsum('...ji,...j->...i', u, dX) * inv_singulars
+        solution = np.einsum('...i,...in->...n', coefficients, vt)
+        return solution, kept.sum(axis=-1), singulars
+
+    def _record_conditioning(self, rank, singulars: np.ndarray):
+        s_max, s_min = singulars[..., 0], singulars[..., -1]
+        self.last_rank = rank
+        self.last_condition_number = np.divide(
+            s_max, s_min,
+            out=np.full(np.shape(s_max), np.inf),
+            where=s_min > 0
+        )
+
+    def meets_target(self, linkage: OpenLinkage, target: np.array) -> bool:
+        return OpenLinkage.Helpers.dist(linkage.last_endpoint(), target) < self.tolerance
+
+    def compute_jacobian(self, linkage: OpenLinkage):
+        return linkage.jacobian()
 
 if __name__ == "__main__":
 
@@ -80,6 +371,22 @@ if __name__ == "__main__":
     assert matched_expected
     print()
 
+    print("== Validating Jacobian against finite differences ==")
+    fd_link = OpenLinkage(
+        link_sizes=[1.5, 0.5, 2, 1],
+        link_angles=[0.3, -1.2, 0.8, 2.0]
+    )
+    eps = 1e-6
+    expected = np.empty((2, fd_link.link_count))
+    for i in range(fd_link.link_count):
+        nudged = OpenLinkage(fd_link.links, fd_link.angles)
+        nudged.move_angles(np.eye(fd_link.link_count)[i] * eps)
+        expected[:, i] = (nudged.last_endpoint() - fd_link.last_endpoint()) / eps
+    matched_expected = np.allclose(controller.compute_jacobian(fd_link), expected, atol=1e-5)
+    print(f"Test {'Succeeded' if matched_expected else 'Failed'}")
+    assert matched_expected
+    print()
+
     print("== Validating Solution (leftwards) == ")
     sol, _, _, _ = controller.get_solution(link, -1, 0)
     got = sol
@@ -145,4 +452,100 @@ if __name__ == "__main__":
         link_angles=[0]
     )
     solution, residuals, rank, s = controller.get_solution(link, dx=0, dy=0)
-    print(f"solution", solution)
\ No newline at end of file
+    print(f"solution", solution)
+
+    print()
+    print("== Validating batch step against single linkages ==")
+    singles = [
+        OpenLinkage(link_sizes=[1, 1, 1], link_angles=[0.1, 0.4, -0.3]),
+        OpenLinkage(link_sizes=[2, 1, 0.5], link_angles=[0.5, 0.2, 1.0]),
+    ]
+    batch = OpenLinkageBatch.from_linkages(singles)
+    targets = np.array([(1.5, 1.0), (-1.0, 2.0)])
+    controller = DifferentialKinematicOpenLinkageController(max_movement=0.5, iterations=3)
+    controller.update(batch, targets)
+    for i, single in enumerate(singles):
+        controller.update(single, targets[i])
+        assert np.allclose(batch.angles[i], single.angles)
+    print("Test Succeeded")
+
+    print()
+    print("== Validating closed-form solver against lstsq ==")
+    lstsq_controller = DifferentialKinematicOpenLinkageController()
+    normal_controller = DifferentialKinematicOpenLinkageController(solver="normal")
+    for name, linkage in test_linkages + [("Random", OpenLinkage(
+        link_sizes=np.random.uniform(0.5, 2, 12),
+        link_angles=np.random.uniform(-1, 1, 12)
+    ))]:
+        expected, _, expected_rank, _ = lstsq_controller.get_solution(linkage, 0.1, -0.2)
+        got, _, rank, _ = normal_controller.get_solution(linkage, 0.1, -0.2)
+        assert rank == expected_rank
+        assert np.allclose(got, expected), name
+        print(name, "rank", rank, "condition number", normal_controller.last_condition_number)
+
+    three_bars = [linkage for _, linkage in test_linkages if linkage.link_count == 3]
+    batch = OpenLinkageBatch.from_linkages(three_bars)
+    dX = np.random.uniform(-0.1, 0.1, (batch.batch_size, 2))
+    for solver_controller in (lstsq_controller, normal_controller):
+        solutions, ranks, _ = solver_controller.get_batch_solution(batch, dX)
+        for i, linkage in enumerate(three_bars):
+            expected, _, expected_rank, _ = lstsq_controller.get_solution(linkage, *dX[i])
+            assert ranks[i] == expected_rank
+            assert np.allclose(solutions[i], expected)
+    print("Test Succeeded")
+
+    print()
+    print("== Damped least squares ==")
+    damped_controller = DifferentialKinematicOpenLinkageController(solver="damped", iterations=100)
+    for name, linkage, target in [
+        ("Reachable", OpenLinkage([1, 1, 1], [0.3, 0.2, 0.1]), np.array((1.0, 1.5))),
+        ("Starts singular", OpenLinkage([1, 1, 1], [0, 0, 0]), np.array((0.5, 1.0))),
+        ("Out of reach", OpenLinkage([1, 1, 1], [0.3, 0.2, 0.1]), np.array((4.0, 0.0))),
+    ]:
+        diagnostics = damped_controller.solve_damped(linkage, target)
+        print(name, diagnostics)
+        assert diagnostics.converged == (name != "Out of reach")
+        assert diagnostics.converged == damped_controller.meets_target(linkage, target)
+    reachable = OpenLinkage([1, 1, 1], [0.3, 0.2, 0.1])
+    assert damped_controller.solve_damped(reachable, np.array((1.0, 1.5)), max_iterations=3).iterations == 3
+
+    # Without tuning, one update of the damped solver reaches the target,
+    # and trial steps it had to undo don't use up its iterations
+    default_damped = DifferentialKinematicOpenLinkageController(solver="damped")
+    assert default_damped.iterations == DifferentialKinematicOpenLinkageController.DAMPED_ITERATIONS
+    target = np.array((2.2, -0.9))
+    diagnostics = default_damped.solve_damped(OpenLinkage([1, 1, 1], [0.1, 2.7, -2.1]), target, max_iterations=3)
+    assert diagnostics.iterations == 3 and diagnostics.rejected_steps > 0
+    linkage = OpenLinkage([1, 1, 1], [0.1, 2.7, -2.1])
+    default_damped.update(linkage, target)
+    assert default_damped.meets_target(linkage, target)
+    print("Test Succeeded")
+
+    print()
+    print("== Solving sampled paths offline ==")
+    from ..view import PathTargetProvider, SplineTargetProvider
+    from .ConstraintController import ConstraintController, LinkageNetwork
+
+    square = PathTargetProvider([np.array(point) for point in [(1.0, 0.5), (1.5, 0.5), (1.5, 1.0), (1.0, 1.0)]])
+    spline = SplineTargetProvider()
+    for x, y in [(1.0, 0.5), (1.6, 0.6), (1.4, 1.2), (0.8, 1.1), (0.7, 0.7)]:
+        spline.button_clicked(x, y)
+
+    link = OpenLinkage([1, 1, 1], [0.3, 0.2, 0.1])
+    start = np.array(link.angles)
+    for provider in (square, spline):
+        targets = provider.sample(np.linspace(0, 1, 120, endpoint=False))
+        trajectory = damped_controller.solve_trajectory(link, targets)
+        assert trajectory.states.shape == (120, 3)
+        assert np.array_equal(link.angles, start)
+        for target, angles in zip(targets, trajectory.states):
+            assert np.allclose(OpenLinkage(link.links, angles).last_endpoint(), target, atol=1e-3)
+        link.set_angles(start)
+
+    network = LinkageNetwork(nodes=[(0, 0), (1, 0)], distance_constraints=[(0, 1, 1)], fixed_constraints=[(0, (0, 0))], bounds=(-1, 2, -1, 2))
+    try:
+        ConstraintController().solve_trajectory(network, targets)
+        assert False
+    except TypeError:
+        pass
+    print("Test Succeeded")
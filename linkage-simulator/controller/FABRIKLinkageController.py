@@ -0,0 +1,105 @@
+from math import atan2, cos, sin, hypot
+
+import numpy as np
+
+from .LinkageController import *
+from .DifferentialKinematicOpenLinkageController import SolveDiagnostics
+
+class FABRIKLinkageController(LinkageController):
+    """Forward And Backward Reaching Inverse Kinematics.
+
+    Works directly on the joint positions: the backward pass pins the end
+    effector to the target and drags each joint back along its link, and the
+    forward pass re-pins the base and drags the joints forwards again. Angle
+    limits are enforced in both passes, against the neighbouring link that
+    has already been placed. Each iteration is O(n).
+    """
+
+    def __init__(self, iterations: int = 10, tolerance: float = 1e-4) -> None:
+        """Create a FABRIK controller.
+
+        Args:
+            iterations (int): Maximum number of forward/backward iterations per update
+            tolerance (float): End effector error at which to stop
+        """
+        self.iterations = iterations
+        self.tolerance = tolerance
+        self.last_diagnostics = None
+
+    def update(self, linkage: OpenLinkage, target: np.array):
+        tx, ty = target
+        links = linkage.links
+        mins, maxs = linkage.link_minangles, linkage.link_maxangles
+        angles = list(linkage.angles)
+        count = len(links)
+
+        points = linkage.endpoints()
+        xs, ys = points[:, 0].tolist(), points[:, 1].tolist()
+        base_x, base_y = xs[0], ys[0]
+        error = hypot(tx - xs[-1], ty - ys[-1])
+
+        diagnostics = SolveDiagnostics()
+        while error >= self.tolerance and diagnostics.iterations < self.iterations:
+            diagnostics.iterations += 1
+
+            # Backward: from the target towards the base, clamping the joint
+            # between each link and the (already placed) link after it
+            xs[count], ys[count] = tx, ty
+            next_absolute = None
+            for i in reversed(range(count)):
+                dx, dy = xs[i + 1] - xs[i], ys[i + 1] - ys[i]
+                if next_absolute is None:
+                    absolute = atan2(dy, dx)
+                else:
+                    relative = angles[i + 1] if dx == 0 and dy == 0 else next_absolute - atan2(dy, dx)
+                    relative = OpenLinkage.Helpers.nearest_angle(relative, angles[i + 1])
+                    absolute = next_absolute - min(max(relative, mins[i + 1]), maxs[i + 1])
+
+                xs[i] = xs[i + 1] - links[i] * cos(absolute)
+                ys[i] = ys[i + 1] - links[i] * sin(absolute)
+                next_absolute = absolute
+
+            # Forward: from the base towards the target, clamping each joint
+            xs[0], ys[0] = base_x, base_y
+            absolute = 0.0
+            for i in range(count):
+                dx, dy = xs[i + 1] - xs[i], ys[i + 1] - ys[i]
+                angle = angles[i] if dx == 0 and dy == 0 else atan2(dy, dx) - absolute
+                angle = OpenLinkage.Helpers.nearest_angle(angle, angles[i])
+                angles[i] = min(max(angle, mins[i]), maxs[i])
+
+                absolute += angles[i]
+                xs[i + 1] = xs[i] + links[i] * cos(absolute)
+                ys[i + 1] = ys[i] + links[i] * sin(absolute)
+
+            error = hypot(tx - xs[-1], ty - ys[-1])
+
+        linkage.set_angles(angles)
+        diagnostics.error = error
+        diagnostics.converged = error < self.tolerance
+        self.last_diagnostics = diagnostics
+
+    def meets_target(self, linkage: OpenLinkage, target: np.array) -> bool:
+        return OpenLinkage.Helpers.dist(linkage.last_endpoint(), target) < self.tolerance
+
+if __name__ == "__main__":
+
+    bars = 200
+    snake = OpenLinkage([0.05] * bars, [0.01] * bars)
+    controller = FABRIKLinkageController(iterations=50)
+
+    for target in [(3, 4), (-2, 1), (0.5, -6)]:
+        target = np.array(target)
+        controller.update(snake, target)
+        print(target, controller.last_diagnostics)
+        assert controller.meets_target(snake, target)
+
+    limited = OpenLinkage([1, 1, 1], [0.2, 0.2, 0.2], link_minangles=-0.5, link_maxangles=0.5)
+    controller.update(limited, np.array((-1, 1)))
+    assert all(-0.5 <= a <= 0.5 for a in limited.angles)
+    assert not controller.last_diagnostics.converged
+
+    reachable = OpenLinkage([1, 1, 1], [0.2, 0.2, 0.2], link_minangles=-0.5, link_maxangles=0.5)
+    controller.update(reachable, OpenLinkage([1, 1, 1], [0.4, -0.3, 0.45]).last_endpoint())
+    assert all(-0.5 <= a <= 0.5 for a in reachable.angles)
+    assert controller.last_diagnostics.converged
@@ -0,0 +1,217 @@
+from typing import Tuple, Union
+
+import numpy as np
+
+from .LinkageController import *
+from .IKLinkageController import IKLinkageController
+
+class IK3RLinkageController(IKLinkageController):
+    """Closed form inverse kinematics for planar 3R linkages.
+
+    A 3R linkage is redundant for a 2D target, so the absolute orientation
+    of the last link is used as the redundancy parameter. With it fixed, the
+    wrist (the joint before the last link) is known and the first two links
+    are solved as a 2R linkage, giving two solution branches.
+    """
+
+    BRANCH_COUNT = 2
+
+    def __init__(self, tolerance: float = 1e-6, orientation: Union[float, None] = None) -> None:
+        """Create a 3R inverse kinematics controller.
+
+        Args:
+            tolerance (float): Distance at which the target is considered met
+            orientation (float, optional): Absolute angle to hold the last link
+                at. If None, the last link keeps its current orientation, or
+                points at the target if the target can't be reached that way.
+        """
+        super().__init__(tolerance)
+        self.orientation = orientation
+
+    @staticmethod
+    def _check_linkage(linkage: OpenLinkage):
+        if linkage.link_count != 3:
+            raise ValueError("3R InverseKinematics controller can only work with 3R linkages.")
+
+    def update(self, linkage: OpenLinkage, target: np.array):
+        IK3RLinkageController._check_linkage(linkage)
+
+        targets = np.asarray(target, float)[np.newaxis]
+        current = np.array(linkage.angles)[np.newaxis]
+
+        orientations = self.choose_orientations(linkage, targets, current)
+        branches, _ = self.inverse_kinematics_branches(linkage, targets, orientations)
+        linkage.set_angles(self.closest_branch(linkage, branches, current)[0])
+
+    def meets_target(self, linkage: OpenLinkage, target: np.array) -> bool:
+        return OpenLinkage.Helpers.dist(linkage.last_endpoint(), target) < self.tolerance
+
+    def choose_orientations(self, linkage: OpenLinkage, targets: np.ndarray, current_angles: np.ndarray) -> np.ndarray:
+        """Picks the last link orientation to solve each target with.
+
+        Args:
+            targets (np.ndarray): (M, 2) targets
+            current_angles (np.ndarray): (M, 3) or (3,) configurations to stay close to
+
+        Returns:
+            np.ndarray: (M,) absolute orientations of the last link
+        """
+        if self.orientation is not None:
+            return np.full(len(targets), self.orientation)
+
+        orientations = np.broadcast_to(np.sum(current_angles, axis=-1), (len(targets),))
+
+        # Point the last link at the target where holding the current
+        # orientation would leave the wrist out of reach.
+        l1, l2, l3 = linkage.links
+        wrists = targets - l3 * np.stack((np.cos(orientations), np.sin(orientations)), axis=1)
+        wrist_dists = np.hypot(wrists[:, 0], wrists[:, 1])
+        out_of_reach = (wrist_dists > l1 + l2) | (wrist_dists < abs(l1 - l2))
+        return np.where(out_of_reach, np.arctan2(targets[:, 1], targets[:, 0]), orientations)
+
+    def inverse_kinematics_branches(self, linkage: OpenLinkage, targets: np.ndarray, orientations: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Every closed form solution of a 3R linkage for many targets.
+
+        Args:
+            linkage (OpenLinkage): 3R linkage
+            targets (np.ndarray): (M, 2) targets for the end effector
+            orientations (np.ndarray): (M,) absolute orientations of the last link
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: (BRANCH_COUNT, M, 3) angles, and a
+                (M,) mask that is False where the wrist was out of reach and
+                the solutions were clamped.
+        """
+        IK3RLinkageController._check_linkage(linkage)
+        l1, l2, l3 = linkage.links
+        targets = np.asarray(targets, float)
+        orientations = np.asarray(orientations, float)
+
+        wrists = targets - l3 * np.stack((np.cos(orientations), np.sin(orientations)), axis=-1)
+
+        branches = np.empty((self.BRANCH_COUNT,) + targets.shape[:-1] + (3,))
+        for branch, elbow_up in enumerate((False, True)):
+            arm_angles, reachable = IKLinkageController.solve_2r(l1, l2, wrists, elbow_up)
+            branches[branch, ..., :2] = arm_angles
+            branches[branch, ..., 2] = orientations - arm_angles[..., 0] - arm_angles[..., 1]
+
+        return branches, reachable
+
+    def closest_branch(self, linkage: OpenLinkage, branches: np.ndarray, reference_angles: np.ndarray) -> np.ndarray:
+        """Selects the branch nearest to a reference configuration.
+
+        Branches within the linkage's angle limits are preferred. The chosen
+        angles are shifted by multiples of 2 pi to be continuous with the
+        reference.
+
+        Args:
+            branches (np.ndarray): (BRANCH_COUNT, M, 3) solutions
+            reference_angles (np.ndarray): (M, 3) or (3,) configurations
+
+        Returns:
+            np.ndarray: (M, 3) angles
+        """
+        offsets = np.mod(branches - reference_angles + np.pi, 2 * np.pi) - np.pi
+        candidates = reference_angles + offsets
+
+        within_limits = np.all(
+            (candidates >= linkage.link_minangles) & (candidates <= linkage.link_maxangles),
+            axis=-1
+        )
+        # Only consider the branches within limits, unless none of them are
+        usable = within_limits | ~within_limits.any(axis=0)
+        distances = np.where(usable, np.sum(offsets * offsets, axis=-1), np.inf)
+
+        best = np.argmin(distances, axis=0)
+        return np.take_along_axis(candidates, best[np.newaxis, :, np.newaxis], axis=0)[0]
+
+    def inverse_kinematics_batch(self, linkage: OpenLinkage, targets: np.ndarray, elbow_up: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """Vectorized 3R inverse kinematics on one branch, with the last link
+        oriented as by update from the linkage's current angles.
+
+        Args:
+            linkage (OpenLinkage): 3R linkage
+            targets (np.ndarray): (M, 2) targets
+            elbow_up (bool): Selects the alternate branch of the first two
+                links (negative second angle), as in IKLinkageController
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: (M, 3) angles and a (M,) reachability mask
+        """
+        IK3RLinkageController._check_linkage(linkage)
+        targets = np.asarray(targets, float)
+        orientations = self.choose_orientations(linkage, targets, np.array(linkage.angles))
+        branches, reachable = self.inverse_kinematics_branches(linkage, targets, orientations)
+        return branches[int(elbow_up)], reachable
+
+    def inverse_kinematics_nearest(self, linkage: OpenLinkage, targets: np.ndarray, reference_angles: Union[np.ndarray, None] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Vectorized 3R inverse kinematics, picking the branch closest to the
+        reference configuration for each target.
+
+        Args:
+            linkage (OpenLinkage): 3R linkage
+            targets (np.ndarray): (M, 2) targets
+            reference_angles (np.ndarray, optional): (M, 3) or (3,) configurations
+                to stay close to. Defaults to the linkage's current angles.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: (M, 3) angles and a (M,) reachability mask
+        """
+        IK3RLinkageController._check_linkage(linkage)
+        targets = np.asarray(targets, float)
+        if reference_angles is None:
+            reference_angles = np.array(linkage.angles)
+
+        orientations = self.choose_orientations(linkage, targets, reference_angles)
+        branches, reachable = self.inverse_kinematics_branches(linkage, targets, orientations)
+        return self.closest_branch(linkage, branches, reference_angles), reachable
+
+    def solve_trajectory(self, linkage: OpenLinkage, targets: np.ndarray, state_duration: float = 1 / 30.0) -> OpenLinkageTrajectory:
+        # Branch selection & the default orientation depend on the previous
+        # state, so solve sequentially.
+        return LinkageController.solve_trajectory(self, linkage, targets, state_duration)
+
+if __name__ == "__main__":
+
+    controller = IK3RLinkageController()
+    link = OpenLinkage([1.0, 0.8, 0.5], [0.4, 0.6, -0.3])
+
+    targets = np.random.uniform(-1.2, 1.2, (50, 2))
+    orientations = np.random.uniform(-np.pi, np.pi, 50)
+    branches, reachable = controller.inverse_kinematics_branches(link, targets, orientations)
+    for i in np.flatnonzero(reachable):
+        for angles in branches[:, i]:
+            reached = OpenLinkage(link.links, angles)
+            assert np.allclose(reached.last_endpoint(), targets[i])
+            assert np.isclose(np.sum(angles), orientations[i])
+
+    # A small move picks the branch we're already on and keeps the orientation
+    start = np.array(link.angles)
+    target = link.last_endpoint() + (0.01, -0.02)
+    controller.update(link, target)
+    assert controller.meets_target(link, target)
+    assert np.allclose(link.angles, start, atol=0.1)
+    assert np.isclose(np.sum(link.angles), np.sum(start))
+
+    angles, reachable = controller.inverse_kinematics_nearest(link, targets)
+    assert angles.shape == (50, 3)
+    # Through the base class interface, elbow_up picks the branch
+    for elbow_up in (False, True):
+        angles, reachable = controller.inverse_kinematics_batch(link, targets, elbow_up=elbow_up)
+        for i in np.flatnonzero(reachable):
+            assert np.allclose(OpenLinkage(link.links, angles[i]).last_endpoint(), targets[i])
+            assert (angles[i, 1] < 0) == elbow_up or np.isclose(angles[i, 1], 0)
+    fixed = IK3RLinkageController(orientation=0.3)
+    trajectory = fixed.solve_trajectory(link, targets[:5] * 0.5)
+    assert np.allclose(np.mod(np.sum(trajectory.states, axis=1) - 0.3 + np.pi, 2 * np.pi), np.pi)
+
+    for call in (
+        lambda linkage: controller.update(linkage, target),
+        lambda linkage: controller.inverse_kinematics_batch(linkage, targets),
+        lambda linkage: controller.inverse_kinematics_nearest(linkage, targets),
+    ):
+        try:
+            call(OpenLinkage([1.0, 0.8]))
+            assert False
+        except ValueError:
+            pass
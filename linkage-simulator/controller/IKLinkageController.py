@@ -13,23 +13,23 @@ class IKLinkageController(LinkageController):
     def update(self, linkage: OpenLinkage, target: np.array):
 
         if len(linkage.links) > 2:
-            raise NotImplemented("InverseKinematics contorller can only work with 1R or 2R linkages.")
+            raise ValueError("InverseKinematics controller can only work with 1R or 2R linkages.")
 
         tx, ty = target
 
         if len(linkage.links) == 1:
-            linkage.angles[0] = atan2(ty, tx)
+            linkage.set_angles((atan2(ty, tx),))
+            return
 
         angs = self.inverse_kinematics(linkage, target)
         linkage.set_angles(angs)
 
     def meets_target(self, linkage: OpenLinkage, target: np.array) -> bool:
         if len(linkage.links) > 2:
-            raise NotImplemented("InverseKinematics contorller can only work with 1R or 2R linkages.")
+            raise ValueError("InverseKinematics controller can only work with 1R or 2R linkages.")
 
-        
         end_point = linkage.last_endpoint()
-        return OpenLinkage.Helpers.dist(end_point - target) < self.tolerance
+        return OpenLinkage.Helpers.dist(end_point, target) < self.tolerance
 
     
     def inverse_kinematics(self, linkage: OpenLinkage, target: np.array) -> Tuple[float, float]:
@@ -61,3 +61,82 @@ class IKLinkageController(LinkageController):
 
         theta1 = C - B
         return theta1, theta2
+
+    def inverse_kinematics_batch(self, linkage: OpenLinkage, targets: np.ndarray, elbow_up: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """Vectorized inverse kinematics of a 1R or 2R linkage for many targets.
+
+        Args:
+            linkage (OpenLinkage): 1R or 2R linkage
+            targets (np.ndarray): (M, 2) targets
+            elbow_up (bool): Selects the alternate 2R branch (negative second
+                angle). The default branch matches inverse_kinematics.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: (M, link_count) angles, and a (M,)
+                mask that is False where the target was out of reach and the
+                solution was clamped.
+        """
+        if linkage.link_count > 2:
+            raise ValueError("InverseKinematics controller can only work with 1R or 2R linkages.")
+
+        targets = np.asarray(targets, float)
+
+        if linkage.link_count == 1:
+            tx, ty = targets[:, 0], targets[:, 1]
+            reachable = np.abs(np.hypot(tx, ty) - linkage.links[0]) < self.tolerance
+            return np.arctan2(ty, tx)[:, np.newaxis], reachable
+
+        l1, l2 = linkage.links
+        return IKLinkageController.solve_2r(l1, l2, targets, elbow_up)
+
+    @staticmethod
+    def solve_2r(l1: float, l2: float, targets: np.ndarray, elbow_up: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """Closed form 2R inverse kinematics, see inverse_kinematics_batch"""
+        tx, ty = targets[..., 0], targets[..., 1]
+        cos_ratio = (tx * tx + ty * ty - l1**2 - l2**2) / (2 * l1 * l2)
+        reachable = np.abs(cos_ratio) <= 1
+
+        theta2 = np.arccos(np.clip(cos_ratio, -1, 1))
+        if elbow_up:
+            theta2 = -theta2
+
+        B = np.arctan2(l2 * np.sin(theta2), l1 + l2 * np.cos(theta2))
+        C = np.arctan2(ty, tx)
+        return np.stack((C - B, theta2), axis=-1), reachable
+
+    def solve_trajectory(self, linkage: OpenLinkage, targets: np.ndarray, state_duration: float = 1 / 30.0) -> OpenLinkageTrajectory:
+        # The closed form solution doesn't depend on the previous state, so
+        # the whole path can be solved at once.
+        states, _ = self.inverse_kinematics_batch(linkage, targets)
+        return OpenLinkageTrajectory(stateDuration=state_duration, states=states)
+
+if __name__ == "__main__":
+
+    controller = IKLinkageController()
+    link = OpenLinkage([1.3, 0.9])
+    targets = np.array([(1.5, 1.5), (-1.5, 0.2), (0.1, -0.5), (3, 3), (0.1, 0.1)])
+
+    for elbow_up in (False, True):
+        angles, reachable = controller.inverse_kinematics_batch(link, targets, elbow_up)
+        assert list(reachable) == [True, True, True, False, False]
+        for target, angs, target_reachable in zip(targets, angles, reachable):
+            if not elbow_up:
+                assert np.allclose(angs, controller.inverse_kinematics(link, target))
+            link.set_angles(angs)
+            assert np.allclose(link.last_endpoint(), target) == target_reachable
+
+    target = np.array((1.5, 1.5))
+    controller.update(link, target)
+    assert controller.meets_target(link, target)
+    assert not controller.meets_target(link, target + (0.1, 0))
+
+    one_bar = OpenLinkage([2])
+    angles, reachable = controller.inverse_kinematics_batch(one_bar, [(0, 2), (-1, 0)])
+    assert np.allclose(angles, [[np.pi / 2], [np.pi]])
+    assert list(reachable) == [True, False]
+
+    try:
+        controller.inverse_kinematics_batch(OpenLinkage([1, 1, 1]), targets)
+        assert False
+    except ValueError:
+        pass
@@ -18,4 +18,31 @@ class LinkageController(ABC):
         pass
 
     def draw(self, ax: matplotlib.axes.Axes, cached) -> List[matplotlib.artist.Artist]:
-        return []
\ No newline at end of file
+        return []
+
+    def solve_trajectory(self, linkage: OpenLinkage, targets: np.ndarray, state_duration: float = 1 / 30.0) -> OpenLinkageTrajectory:
+        """Solves for a whole sequence of targets offline.
+
+        Each target is solved starting from the solution of the previous one.
+        The linkage is restored to its original state afterwards.
+
+        Args:
+            linkage (OpenLinkage): Linkage to solve for
+            targets (np.ndarray): (M, 2) targets, in order
+            state_duration (float): Time between consecutive targets
+
+        Returns:
+            OpenLinkageTrajectory: Trajectory whose states are a (M, link_count) array
+        """
+        if not isinstance(linkage, OpenLinkage):
+            raise TypeError(f"Trajectories can only be solved for an OpenLinkage, not a {type(linkage).__name__}")
+
+        initial_angles = list(linkage.angles)
+        states = np.empty((len(targets), linkage.link_count))
+
+        for i, target in enumerate(targets):
+            self.update(linkage, target)
+            states[i] = linkage.angles
+
+        linkage.set_angles(initial_angles)
+        return OpenLinkageTrajectory(stateDuration=state_duration, states=states)
\ No newline at end of file
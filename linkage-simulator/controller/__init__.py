@@ -1,4 +1,7 @@
 from .LinkageController import LinkageController
 from .DifferentialKinematicOpenLinkageController import DifferentialKinematicOpenLinkageController
 from .IKLinkageController import IKLinkageController
-from .ConstraintController import ConstraintController
\ No newline at end of file
+from .IK3RLinkageController import IK3RLinkageController
+from .ConstraintController import ConstraintController
+from .CCDLinkageController import CCDLinkageController
+from .FABRIKLinkageController import FABRIKLinkageController
\ No newline at end of file
@@ -0,0 +1,235 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import List, Tuple, Union
+import copy
+import os
+
+import numpy as np
+
+from .LinkageNetwork import LinkageNetwork
+
+@dataclass
+class AssemblyModes:
+    """Distinct configurations satisfying all of a LinkageNetwork's constraints"""
+    configurations: np.ndarray  # (M, N, 2), nearest the network's current configuration first
+    hits: np.ndarray            # (M,) starts that converged to each
+    starts: int                 # Starts tried in total
+
+@dataclass
+class AssemblyModeSolver:
+    """Enumerates the assembly modes of a LinkageNetwork that is rigid once
+    its fixed constraints hold, e.g. a mechanism with its driver fixed.
+
+    Gauss-Newton is run from batches of random starting configurations at
+    once, and the configurations they converge to are deduplicated. Batches
+    are drawn until several in a row find no new mode. The current
+    configuration is always the first start.
+
+    Random starts can't prove no mode was missed, but a mode that few starts
+    reach (see AssemblyModes.hits) has a small basin, which is a hint that
+    more starts may be needed.
+    """
+    batch_size: int = 256
+    max_starts: int = 16384
+    # Stop once this many batches in a row find no new mode
+    patience: int = 4
+    max_iterations: int = 60
+    tolerance: float = 1e-10
+    # Configurations closer than this, relative to the mean constraint
+    # length, are the same mode
+    distinct: float = 1e-6
+    # Batches are solved in a pool of this many processes. None uses the CPU
+    # count; 1 solves in this process.
+    processes: Union[int, None] = 1
+    seed: Union[int, None] = None
+
+    def solve(
+        self,
+        network: LinkageNetwork,
+        fixed_constraints: Union[List[LinkageNetwork.FixedConstraint], None] = None
+    ) -> AssemblyModes:
+        """Finds the network's assembly modes. The network is left unchanged.
+
+        Args:
+            fixed_constraints (list, optional): Fixed constraints to hold
+                instead of the network's own
+
+        Returns:
+            AssemblyModes: the modes found
+        """
+        network = copy.deepcopy(network)
+        if fixed_constraints is not None:
+            network.fixed_constraints = fixed_constraints
+        network.set_nodes(network.fixed_locations, network.fixed_indices)
+
+        free = network.free_variable_indices
+        scale = float(network.distance_lengths.mean()) if len(network.distance_lengths) else 1.0
+        rng = np.random.default_rng(self.seed)
+
+        # Starts are drawn from the box around the current nodes, widened
+        # by the longest constraint
+        margin = network.distance_lengths.max(initial=0.0)
+        low = network.nodes.min(axis=0) - margin
+        high = network.nodes.max(axis=0) + margin
+
+        def draw(count):
+            return rng.uniform(low, high, (count, network.node_count, 2)).reshape(count, -1)[:, free]
+
+        probe = network.nodes.reshape(1, -1).copy()
+        probe[:, free] = draw(1)
+        jacobian = AssemblyModeSolver._jacobians(network, probe)[0]
+        freedom = len(free) - np.linalg.matrix_rank(jacobian)
+        if freedom > 0:
+            raise ValueError(f"Network has {freedom} degrees of freedom given its fixed constraints, so its assembly modes aren't isolated")
+
+        current = network.nodes.ravel()[free]
+        modes = np.empty((0, len(free)))
+        hits = np.empty(0, int)
+        starts = 0
+        batches_without_new = 0
+
+        workers = self.processes or os.cpu_count() or 1
+        # Workers are sent the solver & network once, and then only starts
+        pool = ProcessPoolExecutor(self.processes, initializer=_start_worker, initargs=(self, network)) \
+            if self.processes != 1 else None
+        try:
+            while starts < self.max_starts and batches_without_new < self.patience:
+                batches = []
+                for _ in range(workers):
+                    count = min(self.batch_size, self.max_starts - starts)
+                    if count <= 0:
+                        break
+                    batch = draw(count)
+                    if starts == 0:
+                        batch[0] = current
+                    batches.append(batch)
+                    starts += count
+
+                solved = pool.map(_converge_in_worker, batches) \
+                    if pool is not None else map(lambda batch: _converge(self, network, batch), batches)
+
+                for solutions in solved:
+                    mode_count = len(modes)
+                    for solution in solutions:
+                        if len(modes):
+                            distances = np.linalg.norm(modes - solution, axis=1)
+                            nearest = np.argmin(distances)
+                            if distances[nearest] <= self.distinct * scale:
+                                hits[nearest] += 1
+                                continue
+                        modes = np.vstack((modes, solution))
+                        hits = np.append(hits, 1)
+                    batches_without_new = 0 if len(modes) > mode_count else batches_without_new + 1
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        order = np.argsort(np.linalg.norm(modes - current, axis=1), kind="stable")
+        configurations = np.repeat(network.nodes[np.newaxis], len(modes), axis=0).reshape(len(modes), -1)
+        configurations[:, free] = modes[order]
+        return AssemblyModes(
+            configurations=configurations.reshape(len(modes), network.node_count, 2),
+            hits=hits[order],
+            starts=starts
+        )
+
+    @staticmethod
+    def _errors(network: LinkageNetwork, positions: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(S, C) distance errors, and (S, C, 2) unit vectors along each
+        constraint, of a batch of (S, 2N) configurations"""
+        nodes = positions.reshape(len(positions), -1, 2)
+        deltas = nodes[:, network.distance_indices[:, 1]] - nodes[:, network.distance_indices[:, 0]]
+        distances = np.hypot(deltas[..., 0], deltas[..., 1])
+        units = deltas / np.where(distances > 0, distances, 1.0)[..., np.newaxis]
+        return distances - network.distance_lengths, units
+
+    @staticmethod
+    def _jacobians(network: LinkageNetwork, positions: np.ndarray) -> np.ndarray:
+        """(S, C, n) reduced jacobians of a batch of (S, 2N) configurations"""
+        free = network.free_variable_indices
+        _, units = AssemblyModeSolver._errors(network, positions)
+
+        columns = np.full(network.variable_count, -1)
+        columns[free] = np.arange(len(free))
+        jacobians = np.zeros((len(positions), len(network.distance_lengths), len(free)))
+        for end, sign in ((0, -1.0), (1, 1.0)):
+            x_columns = columns[2 * network.distance_indices[:, end]]
+            rows = np.flatnonzero(x_columns >= 0)
+            jacobians[:, rows, x_columns[rows]] = sign * units[:, rows, 0]
+            jacobians[:, rows, x_columns[rows] + 1] = sign * units[:, rows, 1]
+        return jacobians
+
+# State of a pool worker process: the solver and its copy of the network
+_worker = None
+
+def _start_worker(solver: AssemblyModeSolver, network: LinkageNetwork):
+    global _worker
+    _worker = (solver, network)
+
+def _converge_in_worker(starts: np.ndarray) -> np.ndarray:
+    solver, network = _worker
+    return _converge(solver, network, starts)
+
+def _converge(solver: AssemblyModeSolver, network: LinkageNetwork, starts: np.ndarray) -> np.ndarray:
+    """Gauss-Newton from every start at once. Returns the (S', n) free
+    coordinates of the starts that converged."""
+    free = network.free_variable_indices
+    positions = np.repeat(network.nodes.reshape(1, -1), len(starts), axis=0)
+    positions[:, free] = starts
+    # Steps are capped so that starts far from any solution don't fly off
+    max_step = network.distance_lengths.max(initial=1.0)
+
+    for iteration in range(solver.max_iterations + 1):
+        errors, _ = AssemblyModeSolver._errors(network, positions)
+        active = np.flatnonzero(np.abs(errors).max(axis=1, initial=0.0) > solver.tolerance)
+        if len(active) == 0 or iteration == solver.max_iterations:
+            break
+
+        jacobians = AssemblyModeSolver._jacobians(network, positions[active])
+        steps = -(np.linalg.pinv(jacobians) @ errors[active][..., np.newaxis])[..., 0]
+        lengths = np.linalg.norm(steps, axis=1)
+        steps *= np.minimum(1.0, max_step / np.maximum(lengths, 1e-300))[:, np.newaxis]
+        positions[np.ix_(active, free)] += steps
+
+    converged = np.ones(len(starts), bool)
+    converged[active] = False
+    return positions[converged][:, free]
+
+if __name__ == "__main__":
+
+    # A four-bar with its crank held, and a dyad hanging off its rocker:
+    # two ways to close the loop, times two for the dyad
+    network = LinkageNetwork(
+        nodes=[(0, 0), (0.6, 0.8), (2.5, 3.1), (4, 0), (4.2, 2), (1.8, 0.5)],
+        distance_constraints=[(0, 1, 1), (1, 2, 3), (2, 3, 3.5), (2, 4, 2), (4, 5, 2.5)],
+        fixed_constraints=[(0, (0, 0)), (1, (0.6, 0.8)), (3, (4, 0)), (5, (1.8, 0.5))],
+        bounds=(-2, 7, -3, 6)
+    )
+    network.rectify()
+    start = network.nodes.copy()
+
+    modes = AssemblyModeSolver(seed=0).solve(network)
+    assert len(modes.configurations) == 4 and modes.hits.sum() <= modes.starts
+    assert np.allclose(modes.configurations[0], start)
+    assert np.array_equal(network.nodes, start)
+    for configuration in modes.configurations:
+        network.nodes = configuration
+        assert network.satisfies_all_constraints(tolerance=1e-9)
+    network.nodes = start
+
+    # Solving batches in a pool finds the same modes
+    pooled = AssemblyModeSolver(seed=0, processes=2, batch_size=64).solve(network)
+    assert len(pooled.configurations) == 4
+    for configuration in modes.configurations:
+        assert np.min(np.abs(pooled.configurations - configuration).max(axis=(1, 2))) < 1e-6
+
+    # Without the crank held the modes aren't isolated, unless other
+    # fixed constraints are given instead
+    free_crank = [(0, (0, 0)), (3, (4, 0)), (5, (1.8, 0.5))]
+    try:
+        AssemblyModeSolver().solve(network, fixed_constraints=free_crank)
+        assert False
+    except ValueError:
+        pass
+    held_rocker = free_crank + [(2, tuple(start[2]))]
+    assert len(AssemblyModeSolver(seed=0).solve(network, fixed_constraints=held_rocker).configurations) == 4
@@ -0,0 +1,167 @@
+from dataclasses import dataclass, field
+from typing import List, Tuple, Union
+import math
+
+import numpy as np
+
+@dataclass
+class FourBarLoop:
+    """A four-bar loop found in a LinkageNetwork's constraint graph.
+
+    The ground link joins two fixed pivots. The crank node turns about one
+    pivot, the rocker node about the other, and the coupler joins them.
+    Coupler points are free nodes held only by bars to the crank & rocker.
+    Turning either the crank or the rocker determines everything else, by
+    circle intersection.
+
+    Of the two solutions for each intersected node, the one nearest its
+    current position is kept. This tracks the assembly branch the mechanism
+    is in, as long as nodes move less per step than the branches are apart.
+    """
+    ground_crank: int   # Fixed pivot of the crank
+    crank: int
+    rocker: int
+    ground_rocker: int  # Fixed pivot of the rocker
+    # Distance constraint indices of the crank, coupler & rocker bars, then
+    # those of the coupler points (see coupler_points)
+    constraints: np.ndarray
+    # (node, constraint to crank, constraint to rocker) of each coupler point
+    coupler_points: List[Tuple[int, int, int]] = field(default_factory=list)
+
+    @property
+    def nodes(self) -> List[int]:
+        """The moving nodes of the loop"""
+        return [self.crank, self.rocker] + [point for point, _, _ in self.coupler_points]
+
+    def solve(self, network) -> bool:
+        """Puts the crank back at its length from its pivot, keeping its
+        angle, and solves the rest of the loop around it.
+
+        Returns:
+            bool: False, with the nodes left unchanged, if the loop can't
+                close at this crank angle (it is past a dead point)
+        """
+        return self.drive(network, self.crank, network.nodes[self.crank])
+
+    def drive(self, network, node: int, target: np.ndarray) -> bool:
+        """Turns the crank or rocker towards target, and solves the rest of
+        the loop around it.
+
+        Args:
+            network (LinkageNetwork): network the loop is in
+            node (int): crank or rocker
+            target (np.ndarray): point to turn node towards
+
+        Returns:
+            bool: False, with the nodes left unchanged, if the loop can't
+                close at that angle (it is past a dead point)
+        """
+        nodes = network.nodes
+        crank_length, coupler_length, rocker_length = network.distance_lengths[self.constraints[:3]]
+        if node == self.crank:
+            pivot, length, other, other_pivot, other_length = \
+                self.ground_crank, crank_length, self.rocker, self.ground_rocker, rocker_length
+        else:
+            assert node == self.rocker
+            pivot, length, other, other_pivot, other_length = \
+                self.ground_rocker, rocker_length, self.crank, self.ground_crank, crank_length
+
+        dx, dy = target[0] - nodes[pivot, 0], target[1] - nodes[pivot, 1]
+        distance = math.hypot(dx, dy)
+        if distance == 0:
+            return False
+        driven = nodes[pivot] + (dx * length / distance, dy * length / distance)
+
+        joint = FourBarLoop.circle_intersection(driven, coupler_length, nodes[other_pivot], other_length, nodes[other])
+        if joint is None:
+            return False
+
+        positions = {node: driven, other: joint}
+        for point, to_crank, to_rocker in self.coupler_points:
+            positions[point] = FourBarLoop.circle_intersection(
+                positions[self.crank], network.distance_lengths[to_crank],
+                positions[self.rocker], network.distance_lengths[to_rocker],
+                nodes[point]
+            )
+            if positions[point] is None:
+                return False
+
+        network.set_nodes(np.array(list(positions.values())), list(positions))
+        return True
+
+    @staticmethod
+    def circle_intersection(
+        center0: np.ndarray, radius0: float,
+        center1: np.ndarray, radius1: float,
+        near: np.ndarray
+    ) -> Union[np.ndarray, None]:
+        """The intersection of two circles nearest to a point, or None if
+        the circles don't meet. Tangent circles, as at a dead point, meet
+        once."""
+        dx, dy = center1[0] - center0[0], center1[1] - center0[1]
+        distance = math.hypot(dx, dy)
+        slack = 1e-12 * (radius0 + radius1)
+        if distance == 0 or distance > radius0 + radius1 + slack or distance < abs(radius0 - radius1) - slack:
+            return None
+
+        # Distance along the line of centers to the chord, and half the chord
+        along = (radius0 * radius0 - radius1 * radius1 + distance * distance) / (2 * distance)
+        half_chord = math.sqrt(max(radius0 * radius0 - along * along, 0.0))
+
+        ux, uy = dx / distance, dy / distance
+        mx, my = center0[0] + along * ux, center0[1] + along * uy
+        # The perpendicular offset towards near picks its side of the line
+        side = (near[0] - mx) * -uy + (near[1] - my) * ux
+        if side < 0:
+            half_chord = -half_chord
+        return np.array((mx - half_chord * uy, my + half_chord * ux))
+
+if __name__ == "__main__":
+
+    from .LinkageNetwork import LinkageNetwork
+
+    # Grashof crank-rocker: ground 4, crank 1, coupler 3, rocker 3.5, with a
+    # coupler point off the coupler
+    def assemble(angle):
+        crank = np.array((math.cos(angle), math.sin(angle)))
+        rocker = FourBarLoop.circle_intersection(crank, 3, np.array((4.0, 0.0)), 3.5, np.array((4, 10)))
+        point = FourBarLoop.circle_intersection(crank, 2, rocker, 2, crank + (0, 10))
+        return np.array([(0, 0), crank, rocker, (4, 0), point])
+
+    start = assemble(0.3)
+    crank_rocker = LinkageNetwork(
+        nodes=start,
+        distance_constraints=[(0, 1, 1), (1, 2, 3), (2, 3, 3.5), (1, 4, 2), (2, 4, 2)],
+        fixed_constraints=[(0, (0, 0)), (3, (4, 0))],
+        bounds=(-2, 6, -3, 6)
+    )
+    [loop] = crank_rocker.four_bar_loops
+    assert (loop.ground_crank, loop.crank, loop.rocker, loop.ground_rocker) == (0, 1, 2, 3)
+    assert [point for point, _, _ in loop.coupler_points] == [4]
+    assert crank_rocker.is_closed_form(0)
+
+    # Turning the crank a full revolution in small steps stays exact and on
+    # the starting branch
+    for angle in np.linspace(0.3, 0.3 + 2 * np.pi, 200)[1:]:
+        assert loop.drive(crank_rocker, 1, 10 * np.array((math.cos(angle), math.sin(angle))))
+        assert np.allclose(crank_rocker.nodes, assemble(angle))
+    assert np.allclose(crank_rocker.nodes, start)
+    assert crank_rocker.satisfies_all_constraints(tolerance=1e-12)
+
+    # The rocker can't swing past its limits
+    assert not loop.drive(crank_rocker, 2, np.array((4, -10)))
+    assert np.allclose(crank_rocker.nodes, start)
+
+    # rectify solves the loop without a least squares step
+    crank_rocker.move_nodes([(0, 0), (0.05, -0.02), (0.05, -0.02), (0, 0), (0.1, 0.1)])
+    crank_rocker.rectify()
+    assert crank_rocker.last_rectify.iterations == 0
+    assert crank_rocker.satisfies_all_constraints(tolerance=1e-12)
+
+    # A bar hanging off the rocker leaves the rest to the generic solver
+    crank_rocker.nodes = np.concatenate((crank_rocker.nodes, [crank_rocker.nodes[2] + (1, 0)]))
+    crank_rocker.distance_constraints = crank_rocker.distance_constraints + ((2, 5, 1),)
+    assert len(crank_rocker.four_bar_loops) == 1 and not crank_rocker.is_closed_form(0)
+    crank_rocker.move_nodes(np.concatenate(([(0, 0)], np.random.uniform(-0.02, 0.02, (5, 2)))))
+    crank_rocker.rectify()
+    assert crank_rocker.last_rectify.converged
@@ -8,6 +8,8 @@ import matplotlib.artist
 class Linkage(ABC):
     Bounds = Tuple[float, float, float, float]
 
+    __slots__ = ()
+
     @abstractmethod
     def get_plot_bounds(self) -> Bounds:
         raise NotImplemented()
@@ -1,15 +1,183 @@
 
 from typing import Tuple, List, Union, Sequence
+from dataclasses import dataclass
+import math
 
 import numpy as np
+import scipy.sparse
+import scipy.sparse.linalg
+import scipy.sparse.csgraph
+import scipy.spatial
 import matplotlib.collections
 from matplotlib.artist import Artist
 from matplotlib.axes import Axes
 
 from .Linkage import Linkage
+from .FourBarLoop import FourBarLoop
+from .PebbleGame import PebbleGame
+from .XPBDSolver import XPBDSolver
+
+@dataclass
+class RectifyDiagnostics:
+    """Summary of the last LinkageNetwork.rectify call"""
+    iterations: int = 0
+    residual: float = 0.0
+    converged: bool = True
+    # Steps taken with a given factorization rather than a fresh jacobian
+    factorization_steps: int = 0
+
+@dataclass
+class ConstraintViolation:
+    """How far a network is from satisfying its constraints"""
+    errors: np.ndarray                          # (constraint_count,) as from constraint_errors
+    max_error: float                            # Largest absolute error
+    rms_error: float                            # Root mean square error
+    violated_distance_constraints: np.ndarray   # Indices of distance constraints over tolerance
+    violated_fixed_constraints: np.ndarray      # Indices of fixed constraints over tolerance
+
+    @property
+    def satisfied(self) -> bool:
+        return len(self.violated_distance_constraints) == 0 and len(self.violated_fixed_constraints) == 0
+
+@dataclass
+class SolverBlock:
+    """The part of a LinkageNetwork's solver system (see solver_jacobian)
+    belonging to one connected component"""
+    rows: np.ndarray        # Rows of the solver system
+    columns: np.ndarray     # Columns of the solver system
+    nodes: np.ndarray       # Nodes the columns move
+    distances: np.ndarray   # Distance constraints of the rows
+    fixed: np.ndarray       # Fixed constraints of the rows, none in reduced coordinates
+    # Which of the block constraints' jacobian values (see
+    # LinkageNetwork._jacobian_values) are kept & where, as from _csr_pattern
+    pattern: Tuple
+
+@dataclass
+class RigidBodyLayout:
+    """How a LinkageNetwork maps onto rigid bodies & free points.
+
+    Each rigid cluster is a body with 3 variables (x, y, angle). Nodes in no
+    cluster keep 2 point variables. Nodes shared by several bodies are
+    referenced once per body, and those references pinned together.
+    References 0..N-1 are each node's primary one.
+    """
+    clusters: List[np.ndarray]          # Nodes of each body
+    body_constraints: List[np.ndarray]  # Distance constraints within each body
+    point_nodes: np.ndarray             # (P,) nodes that aren't part of a body
+    reference_nodes: np.ndarray         # (R,) node of each reference
+    reference_bodies: np.ndarray        # (R,) body of each reference, or -1 for points
+    reference_columns: np.ndarray       # (R, 3) columns for the x, y & angle derivatives
+    external_constraints: np.ndarray    # Distance constraints between bodies & points
+
+    @property
+    def variable_count(self) -> int:
+        return 3 * len(self.clusters) + 2 * len(self.point_nodes)
+
+class ConstraintFactorization:
+    """Thin SVD of a constraint jacobian J = U S V^T.
+
+    Computed once and shared by everything that needs J+: projecting onto
+    the nullspace of the constraints and the least squares rectify steps.
+    """
+
+    def __init__(self, jacobian: np.ndarray, rcond: Union[float, None] = None, component: Union[int, None] = None):
+        """Factorize a (constraint_count, variable_count) jacobian.
+
+        Args:
+            jacobian (np.ndarray): dense jacobian to factorize
+            rcond (float, optional): Singular values below rcond times the
+                largest are treated as zero. Defaults to machine epsilon
+                times the largest dimension, as in np.linalg.lstsq.
+            component (int, optional): Connected component of the network
+                the jacobian is restricted to, or None for the whole network
+        """
+        self.component = component
+        constraint_count, variable_count = jacobian.shape
+        if rcond is None:
+            rcond = np.finfo(float).eps * max(constraint_count, variable_count)
+
+        if jacobian.size == 0:
+            u, s, vt = np.zeros((constraint_count, 0)), np.zeros(0), np.zeros((0, variable_count))
+        else:
+            u, s, vt = np.linalg.svd(jacobian, full_matrices=False)
+
+        self.rank = int(np.sum(s > rcond * s[0])) if len(s) else 0
+        self.left = u[:, :self.rank]
+        self.singulars = s[:self.rank]
+        # Orthonormal basis of the row space, (rank, variable_count)
+        self.rowspace = vt[:self.rank]
+
+    def project_onto_nullspace(self, vector: np.ndarray) -> np.ndarray:
+        """(I - J+ J) vector: the part of vector that keeps the constraints satisfied"""
+        return vector - self.rowspace.T @ (self.rowspace @ vector)
+
+    def solve(self, rhs: np.ndarray) -> np.ndarray:
+        """Minimum norm least squares solution x of J x = rhs"""
+        return self.rowspace.T @ ((self.left.T @ rhs) / self.singulars)
+
+class SparseConstraintFactorization(ConstraintFactorization):
+    """Sparse LU factorization of J J^T, for jacobians too large to SVD.
+
+    J+ = J^T (J J^T)+, so both the projection and the solve come down to
+    solving for multipliers with J J^T. Redundant constraints make J J^T
+    singular, so a small multiple of the identity is added before
+    factorizing, and the bias this adds is removed by iterative refinement.
+    Memory and time scale with the fill of the factors rather than the
+    square & cube of the size.
+    """
+
+    # The identity added to J J^T, relative to its largest diagonal entry
+    REGULARIZATION = np.sqrt(np.finfo(float).eps)
+    # Refinement solves after the first, each shrinking the bias on a
+    # singular value s of J by a factor of about REGULARIZATION / s^2
+    REFINEMENTS = 2
+
+    def __init__(self, jacobian: scipy.sparse.csr_matrix, component: Union[int, None] = None):
+        """Factorize a sparse (constraint_count, variable_count) jacobian.
+
+        Args:
+            jacobian (scipy.sparse.csr_matrix): jacobian to factorize
+            component (int, optional): Connected component of the network
+                the jacobian is restricted to, or None for the whole network
+        """
+        self.component = component
+        self.jacobian = scipy.sparse.csr_matrix(jacobian)
+        self.jacobian_t = self.jacobian.T.tocsr()
+        self.normal = (self.jacobian @ self.jacobian_t).tocsc()
+
+        constraint_count = self.normal.shape[0]
+        self.lu = None
+        if constraint_count:
+            scale = max(float(self.normal.diagonal().max()), np.finfo(float).tiny)
+            shift = SparseConstraintFactorization.REGULARIZATION * scale * scipy.sparse.identity(constraint_count, format="csc")
+            self.lu = scipy.sparse.linalg.splu(self.normal + shift, permc_spec="MMD_AT_PLUS_A")
+
+    def multipliers(self, rhs: np.ndarray) -> np.ndarray:
+        """Minimum norm solution of J J^T x = rhs, for rhs in the range of J"""
+        if self.lu is None:
+            return np.zeros(0)
+        x = self.lu.solve(rhs)
+        for _ in range(SparseConstraintFactorization.REFINEMENTS):
+            x += self.lu.solve(rhs - self.normal @ x)
+        return x
+
+    def project_onto_nullspace(self, vector: np.ndarray) -> np.ndarray:
+        return vector - self.jacobian_t @ self.multipliers(self.jacobian @ vector)
+
+    def solve(self, rhs: np.ndarray) -> np.ndarray:
+        return self.jacobian_t @ self.multipliers(rhs)
 
 class LinkageNetwork(Linkage):
 
+    # Above this many variables, rectify uses the sparse iterative solver
+    SPARSE_VARIABLE_THRESHOLD = 200
+    # Largest constraint error still considered satisfied
+    SATISFACTION_TOLERANCE = 1e-6
+    # The spatial index is rebuilt once the nodes may have drifted further
+    # than this fraction of the mean constraint length from where they were
+    # indexed
+    SPATIAL_INDEX_SLACK = 0.25
+
     Point = Union[Tuple[float, float], np.array]
     NodeIndex = int
     DistanceConstraint = Tuple[NodeIndex, NodeIndex, float]
@@ -18,33 +186,140 @@ class LinkageNetwork(Linkage):
     def __init__(self, nodes: List[Point], 
         distance_constraints: List[DistanceConstraint], 
         bounds: Linkage.Bounds,
-        fixed_constraints: List[FixedConstraint]):
+        fixed_constraints: List[FixedConstraint],
+        reduced_coordinates: bool = False,
+        rigid_bodies: bool = False,
+        xpbd: Union[XPBDSolver, None] = None):
+        """Create a network of nodes joined by distance constraints.
+
+        Args:
+            reduced_coordinates (bool): Solve with the fixed nodes eliminated
+                from the variables, rather than held in place by two jacobian
+                rows each. See solver_variable_indices.
+            rigid_bodies (bool): Rectify with each rigid cluster of nodes
+                moved as one rigid body. See rigid_clusters.
+            xpbd (XPBDSolver, optional): Rectify with this position based
+                solver instead of least squares, for networks too large to
+                solve exactly every frame
+        """
         
-        self.nodes = [np.array(node, float) for node in nodes] # ensure all nodes are numpy arrays
+        self.nodes = nodes
+        self.bounds = bounds
+        self.reduced_coordinates = reduced_coordinates
+        self.rigid_bodies = rigid_bodies
+        self.xpbd = xpbd
+        # Incremented whenever the constraints are replaced, so cached
+        # solver state from before can be recognized as stale
+        self.topology_version = 0
+
         self.distance_constraints = distance_constraints
         self.fixed_constraints = fixed_constraints
-        self.bounds = bounds
 
-        fixed_nodes = (i for i, _ in fixed_constraints)
-        self.fixed_nodes = set(fixed_nodes)
+        self.last_rectify = RectifyDiagnostics()
+
+    @property
+    def nodes(self) -> np.ndarray:
+        """Read only (N, 2) view of the node positions. Variable 2i is x of
+        node i, 2i+1 is y. Assign to this property, or use set_nodes /
+        move_nodes, to change them.
+
+        Picking (nearest_node, nodes_within) keeps track of how far the nodes
+        have moved rather than checking them on every query, so the nodes
+        can't be edited in place.
+        """
+        view = self._nodes.view()
+        view.flags.writeable = False
+        return view
+
+    @nodes.setter
+    def nodes(self, nodes: Union[np.ndarray, List[Point]]):
+        self._nodes = np.array(nodes, float).reshape(-1, 2)
+        self._spatial_drift = math.inf
+
+    def set_nodes(self, positions: np.ndarray, indices: Union[Sequence[int], np.ndarray, slice] = slice(None)):
+        """Moves the indexed nodes to (len(indices), 2) positions"""
+        displacement = np.reshape(positions - self._nodes[indices], (-1, 2))
+        self._nodes[indices] = positions
+        self._nodes_moved(math.sqrt(np.einsum('ij,ij->i', displacement, displacement).max(initial=0.0)))
+
+    def move_nodes(self, displacement: np.ndarray):
+        """Adds a (N, 2) displacement to the nodes"""
+        self._nodes += displacement
+        self._nodes_moved(math.sqrt(np.einsum('ij,ij->i', displacement, displacement).max(initial=0.0)))
+
+    def _nodes_moved(self, distance: float):
+        """Records that no node moved further than distance"""
+        self._spatial_drift += distance
+
+    @property
+    def distance_constraints(self) -> Tuple[DistanceConstraint, ...]:
+        """The distance constraints as (i, j, length) tuples.
+        
+        Constraints are stored as the `distance_indices` (C, 2) and
+        `distance_lengths` (C,) arrays, so this is a copy, and a tuple so
+        that attempts to edit it fail. Assign a whole new sequence to this
+        property to change the constraints; lengths can also be changed in
+        place through `distance_lengths`.
+        """
+        return tuple(
+            (i, j, length)
+            for (i, j), length in zip(self.distance_indices.tolist(), self.distance_lengths.tolist())
+        )
+
+    @distance_constraints.setter
+    def distance_constraints(self, distance_constraints: List[DistanceConstraint]):
+        self.distance_indices = np.array(
+            [(i, j) for i, j, _ in distance_constraints], int
+        ).reshape(-1, 2)
+        self.distance_lengths = np.array(
+            [length for _, _, length in distance_constraints], float
+        )
 
         # Sanity Check
-        for node in nodes:
-            assert len(node) == 2
-        for i, j, length in distance_constraints:
-            assert 0 <= i < len(nodes)
-            assert 0 <= j < len(nodes)
-            assert i != j
-            assert length > 0
+        assert np.all((0 <= self.distance_indices) & (self.distance_indices < self.node_count))
+        assert np.all(self.distance_indices[:, 0] != self.distance_indices[:, 1])
+        assert np.all(self.distance_lengths > 0)
+
+        self._topology_changed()
+
+    @property
+    def fixed_constraints(self) -> Tuple[FixedConstraint, ...]:
+        """The fixed constraints as (i, location) tuples, stored as the
+        `fixed_indices` (F,) and `fixed_locations` (F, 2) arrays. Like
+        distance_constraints this is a read only copy: assign a whole new
+        sequence to change the constraints."""
+        return tuple(zip(self.fixed_indices.tolist(), map(tuple, self.fixed_locations.tolist())))
+
+    @fixed_constraints.setter
+    def fixed_constraints(self, fixed_constraints: List[FixedConstraint]):
+        self.fixed_indices = np.array([i for i, _ in fixed_constraints], int)
+        self.fixed_locations = np.array(
+            [loc for _, loc in fixed_constraints], float
+        ).reshape(-1, 2)
+        self.fixed_nodes = set(self.fixed_indices.tolist())
+
+        assert np.all((0 <= self.fixed_indices) & (self.fixed_indices < self.node_count))
+
+        self._topology_changed()
+
+    def _topology_changed(self):
+        # Clear everything derived from which nodes the constraints connect
+        self.topology_version += 1
+        self._jacobian_pattern = None
+        self._reduced_jacobian_pattern = None
+        self._free_variables = None
+        self._components = None
+        self._blocks = {}
+        self._rigid_clusters = None
+        self._rigid_layout = None
+        self._constraint_colors = None
+        self._four_bar_loops = None
+        self._spatial_index = None
 
     def draw(self, ax: Axes, prev: Sequence[Artist]) -> Sequence[Artist]:
         
-        segments = [
-            (self.nodes[i], self.nodes[j]) 
-            for i, j, _ in self.distance_constraints
-        ]
-
-        fixed = [loc for _, loc in self.fixed_constraints]
+        segments = self.nodes[self.distance_indices]
+        fixed = self.fixed_locations
 
         if prev:
             prev[0].set_segments(segments)
@@ -55,33 +330,98 @@ class LinkageNetwork(Linkage):
         lines_coll = matplotlib.collections.LineCollection(segments)
         ax.add_collection(lines_coll)
 
-        x, y = zip(*self.nodes)
-        nodes_plt = ax.scatter(x, y)
-
-        fixed_x, fixed_y = zip(*fixed)
-        fixed_plt = ax.scatter(fixed_x, fixed_y)
+        nodes_plt = ax.scatter(self.nodes[:, 0], self.nodes[:, 1])
+        fixed_plt = ax.scatter(fixed[:, 0], fixed[:, 1])
         return lines_coll, nodes_plt, fixed_plt
 
     def get_plot_bounds(self) -> Tuple[float, float, float, float]:
         return self.bounds
 
-    def satisfies_distance_constraint(self, constraint_index: int) -> bool:
-        raise NotImplemented()
+    def satisfies_distance_constraint(self, constraint_index: int, tolerance: float = SATISFACTION_TOLERANCE) -> bool:
+        return abs(self.distance_constraint_error(constraint_index)) <= tolerance
 
-    def satisfies_fixed_constraint(self, constraint_index: int) -> bool:
-        raise NotImplemented()
+    def satisfies_fixed_constraint(self, constraint_index: int, tolerance: float = SATISFACTION_TOLERANCE) -> bool:
+        return max(map(abs, self.fixed_consraint_error(constraint_index))) <= tolerance
 
-    def satisfies_all_constraints(self) -> bool:
-        
-        for i in range(len(self.distance_constraints)):
-            if not self.satisfies_distance_constraint(i):
-                return False
+    def satisfies_all_constraints(self, tolerance: float = SATISFACTION_TOLERANCE) -> bool:
+        return np.abs(self.constraint_errors()).max(initial=0.0) <= tolerance
+
+    def constraint_violation(self, tolerance: float = SATISFACTION_TOLERANCE) -> ConstraintViolation:
+        """Summarizes every constraint error in a few vectorized passes.
+
+        Args:
+            tolerance (float): Largest absolute error considered satisfied. A
+                fixed constraint is violated if its x or y error exceeds it.
+        """
+        errors = self.constraint_errors()
+        abs_errors = np.abs(errors)
+        distance_count = len(self.distance_lengths)
+
+        return ConstraintViolation(
+            errors=errors,
+            max_error=float(abs_errors.max(initial=0.0)),
+            rms_error=float(np.sqrt(np.mean(errors * errors))) if len(errors) else 0.0,
+            violated_distance_constraints=np.flatnonzero(abs_errors[:distance_count] > tolerance),
+            violated_fixed_constraints=np.flatnonzero(
+                abs_errors[distance_count:].reshape(-1, 2).max(axis=1, initial=0.0) > tolerance
+            ),
+        )
+
+    def nearest_node(self, point: Point) -> int:
+        """Index of the free (not fixed) node closest to point.
+
+        Ties go to the lowest index. Raises ValueError if every node is fixed.
+        """
+        tree, free, drift = self._get_spatial_index()
+        if len(free) == 0:
+            raise ValueError("Network has no free nodes")
+
+        point = np.asarray(point, float)
+        _, nearest = tree.query(point)
+        if drift == 0:
+            candidates = free[[nearest]]
+        else:
+            # Nodes have moved since being indexed, but by at most drift, so
+            # the true nearest node was indexed within this bound of point.
+            # The tree's own pick is kept explicitly, as rounding can leave it
+            # just outside the bound.
+            bound = np.linalg.norm(self.nodes[free[nearest]] - point) + drift
+            candidates = free[np.union1d(np.array(tree.query_ball_point(point, bound), int), [nearest])]
 
-        for i in range(len(self.fixed_constraints)):
-            if not self.satisfies_fixed_constraint(i):
-                return False
+        offsets = self.nodes[candidates] - point
+        return int(candidates[np.argmin(np.einsum('ij,ij->i', offsets, offsets))])
 
-        return True
+    def nodes_within(self, point: Point, radius: float) -> np.ndarray:
+        """Sorted indices of the free nodes within radius of point"""
+        tree, free, drift = self._get_spatial_index()
+        point = np.asarray(point, float)
+
+        candidates = free[np.sort(np.array(tree.query_ball_point(point, radius + drift), int))]
+        offsets = self.nodes[candidates] - point
+        return candidates[np.einsum('ij,ij->i', offsets, offsets) <= radius * radius]
+
+    def _get_spatial_index(self) -> Tuple[scipy.spatial.cKDTree, np.ndarray, float]:
+        """KD-tree over the free nodes, with the indices of the free nodes
+        and a bound on how far any of them has moved since the tree was
+        built.
+
+        The bound is the sum of the largest displacement of each move (see
+        _nodes_moved), so checking it costs nothing per query. The tree is
+        kept until the bound grows too large, and queries widen their search
+        by it to stay exact.
+        """
+        if self._spatial_index is not None:
+            tree, free, max_drift = self._spatial_index
+            if self._spatial_drift <= max_drift:
+                return tree, free, self._spatial_drift
+
+        free = np.setdiff1d(np.arange(self.node_count), self.fixed_indices)
+        tree = scipy.spatial.cKDTree(self.nodes[free])
+        max_drift = LinkageNetwork.SPATIAL_INDEX_SLACK * self.distance_lengths.mean() if len(self.distance_lengths) else 0.0
+
+        self._spatial_index = tree, free, max_drift
+        self._spatial_drift = 0.0
+        return tree, free, 0.0
 
     def is_fixed_node(self, node_index: int) -> bool:
         return node_index in self.fixed_nodes
@@ -94,44 +434,769 @@ class LinkageNetwork(Linkage):
     def variable_count(self) -> int:
         return self.node_count * 2
 
-    def rectify(self):
-        jacobian = self.constraint_jacobian()
-        
-        errors = [
-            self.distance_constraint_error(i)
-            for i in range(len(self.distance_constraints))
-        ]
-
-        for i in range(len(self.fixed_constraints)):
-            errors.extend(self.fixed_consraint_error(i))
-
-        errors = np.array([errors]).T
-        dx = -errors
-        changes, residuals, rank, singulars = np.linalg.lstsq(jacobian, dx, rcond=None) 
-
-        for i in range(self.node_count):
-            dx = changes[i*2][0]
-            dy = changes[i*2 + 1][0]
-            self.nodes[i] = self.nodes[i] + np.array((dx, dy), float)
-        
-        return changes
+    @property
+    def free_variable_indices(self) -> np.ndarray:
+        """Indices of the coordinates of the nodes that aren't fixed, into
+        the full (variable_count,) variable vector"""
+        if self._free_variables is None:
+            free = np.ones(self.variable_count, bool)
+            free[2 * self.fixed_indices] = False
+            free[2 * self.fixed_indices + 1] = False
+            self._free_variables = np.flatnonzero(free)
+            self._free_variables.flags.writeable = False
+        return self._free_variables
 
-    def constraint_jacobian(self):
-        
-        jacobian_distance = [
-            self.distance_constraint_partial_derivs(i)
-            for i in range(len(self.distance_constraints))
-        ]
-
-        jacobian_fixed = []
-        for i in range(len(self.fixed_constraints)):
-            jacobian_fixed.extend(
-                self.fixed_constraint_partial_derivs(i)
-            )    
-        
-        jacobian = jacobian_distance
-        jacobian.extend(jacobian_fixed)
-        return np.array(jacobian)
+    @property
+    def solver_variable_count(self) -> int:
+        """Length of the variable vectors the solvers work with: the free
+        variables in reduced coordinates, otherwise every variable"""
+        return len(self.free_variable_indices) if self.reduced_coordinates else self.variable_count
+
+    def to_reduced(self, vector: np.ndarray) -> np.ndarray:
+        """Drops the fixed node entries from a (variable_count,) vector"""
+        return vector[self.free_variable_indices]
+
+    def to_full(self, reduced: np.ndarray) -> np.ndarray:
+        """Expands a reduced vector back to (variable_count,), with zeros for
+        the fixed nodes"""
+        vector = np.zeros(self.variable_count)
+        vector[self.free_variable_indices] = reduced
+        return vector
+
+    @property
+    def component_labels(self) -> np.ndarray:
+        """(N,) connected component of the constraint graph each node is in"""
+        if self._components is None:
+            adjacency = scipy.sparse.coo_matrix(
+                (np.ones(len(self.distance_indices)), (self.distance_indices[:, 0], self.distance_indices[:, 1])),
+                shape=(self.node_count, self.node_count)
+            )
+            self._components = scipy.sparse.csgraph.connected_components(adjacency, directed=False)
+            self._components[1].flags.writeable = False
+        return self._components[1]
+
+    @property
+    def component_count(self) -> int:
+        return int(self.component_labels.max(initial=-1)) + 1
+
+    def _get_block(self, component: int) -> SolverBlock:
+        """The rows & columns of the solver system that belong to a connected
+        component. Components don't share constraints, so the solver system
+        is block diagonal in them, and each block can be evaluated without
+        touching the rest of the network."""
+        key = (component, self.reduced_coordinates)
+        if key not in self._blocks:
+            labels = self.component_labels
+            distances = np.flatnonzero(labels[self.distance_indices[:, 0]] == component)
+            if self.reduced_coordinates:
+                fixed = np.empty(0, int)
+            else:
+                fixed = np.flatnonzero(labels[self.fixed_indices] == component)
+            rows = np.concatenate((distances, len(self.distance_lengths) + (2 * fixed[:, np.newaxis] + (0, 1)).ravel()))
+            columns, nodes = self._solver_columns(np.flatnonzero(labels == component))
+
+            # Lay the block's jacobian out the way _get_jacobian_pattern lays
+            # out the whole network's, with rows & columns local to the block
+            local_columns = np.full(self.variable_count, -1)
+            local_columns[(2 * nodes[:, np.newaxis] + (0, 1)).ravel()] = np.arange(len(columns))
+            entry_rows = np.concatenate((np.repeat(np.arange(len(distances)), 4), len(distances) + np.arange(2 * len(fixed))))
+            entry_cols = local_columns[np.concatenate((
+                (2 * self.distance_indices[distances][:, :, np.newaxis] + (0, 1)).ravel(),
+                (2 * self.fixed_indices[fixed][:, np.newaxis] + (0, 1)).ravel()
+            ))]
+            entries = np.flatnonzero(entry_cols >= 0)
+            pattern = LinkageNetwork._csr_pattern(entries, entry_rows[entries], entry_cols[entries], (len(rows), len(columns)))
+
+            self._blocks[key] = SolverBlock(rows, columns, nodes, distances, fixed, pattern)
+        return self._blocks[key]
+
+    def _solver_columns(self, nodes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Columns of solver_jacobian for the coordinates of some nodes, and
+        the nodes they belong to (fixed nodes have none in reduced coordinates)"""
+        if self.reduced_coordinates:
+            positions = np.full(self.node_count, -1)
+            free_nodes = self.free_variable_indices[::2] // 2
+            positions[free_nodes] = np.arange(len(free_nodes))
+            nodes = nodes[positions[nodes] >= 0]
+            columns = positions[nodes]
+        else:
+            columns = nodes
+        return (2 * columns[:, np.newaxis] + (0, 1)).ravel(), nodes
+
+    def solver_errors(self, component: Union[int, None] = None) -> np.ndarray:
+        """Constraint errors matching the rows of solver_jacobian"""
+        return self._block_errors(None if component is None else self._get_block(component))
+
+    def _block_errors(self, block: Union[SolverBlock, None]) -> np.ndarray:
+        if block is None:
+            return self.constraint_errors(self.reduced_coordinates)
+        fixed_errors = self.nodes[self.fixed_indices[block.fixed]] - self.fixed_locations[block.fixed]
+        return np.concatenate((self._distance_errors(block.distances), fixed_errors.ravel()))
+
+    def solver_jacobian(self, component: Union[int, None] = None, sparse: bool = False) -> Union[np.ndarray, scipy.sparse.csr_matrix]:
+        """The normalized jacobian the solvers work with: in reduced
+        coordinates if the network uses them, and optionally restricted to
+        one connected component.
+
+        Args:
+            component (int, optional): Only include this component's rows & columns
+            sparse (bool): Return a scipy.sparse CSR matrix instead of a dense array
+        """
+        return self._block_jacobian(None if component is None else self._get_block(component), sparse)
+
+    def _block_jacobian(self, block: Union[SolverBlock, None], sparse: bool = False):
+        """solver_jacobian restricted to a block"""
+        if block is None:
+            return self.constraint_jacobian(sparse=sparse, normalized=True, reduced=self.reduced_coordinates)
+
+        values = self._jacobian_values(True, block.distances, len(block.fixed))
+        return LinkageNetwork._assemble_jacobian(block.pattern, values, sparse)
+
+    def to_solver(self, vector: np.ndarray, component: Union[int, None] = None) -> np.ndarray:
+        """Takes the entries of a (variable_count,) vector matching the
+        columns of solver_jacobian"""
+        if self.reduced_coordinates:
+            vector = self.to_reduced(vector)
+        if component is not None:
+            vector = vector[self._get_block(component).columns]
+        return vector
+
+    def from_solver(self, vector: np.ndarray, component: Union[int, None] = None) -> np.ndarray:
+        """Expands a vector over the columns of solver_jacobian back to
+        (variable_count,), with zeros everywhere else"""
+        if component is not None:
+            block_vector = vector
+            vector = np.zeros(self.solver_variable_count)
+            vector[self._get_block(component).columns] = block_vector
+        if self.reduced_coordinates:
+            vector = self.to_full(vector)
+        return vector
+
+    def rectify(
+        self,
+        tolerance: float = 1e-9,
+        max_iterations: int = 10,
+        sparse: Union[bool, None] = None,
+        factorization: Union[ConstraintFactorization, None] = None,
+        component: Union[int, None] = None,
+        pinned: Sequence[int] = ()
+    ) -> np.ndarray:
+        """Moves the nodes to satisfy the constraints with Gauss-Newton steps.
+
+        Each step is the minimum norm least squares solution of J dx = -errors,
+        so nodes only move as much as needed to correct the constraints.
+        Iteration stops once every constraint error is within tolerance; the
+        outcome is recorded in `last_rectify`.
+
+        Each connected component of the constraint graph is solved on its
+        own, and components whose constraints are already within tolerance
+        are skipped. Four-bar loops (see four_bar_loops) are solved in closed
+        form first, so only the rest of the network needs Gauss-Newton steps.
+        With rigid_bodies set, the network is instead solved as
+        a whole in rigid body coordinates, ignoring factorization & component.
+        With an xpbd solver set, that is used instead, within its own
+        iteration budget.
+
+        In reduced coordinates, the fixed nodes are first put back at their
+        locations and only the free nodes are solved for.
+
+        Args:
+            tolerance (float): Largest acceptable absolute constraint error
+            max_iterations (int): Most Gauss-Newton steps to take per component
+            sparse (bool, optional): Solve each step with LSMR on the sparse
+                jacobian rather than a dense lstsq. Defaults to sparse for
+                components with more than SPARSE_VARIABLE_THRESHOLD variables.
+            factorization (ConstraintFactorization, optional): Factorization of
+                a recent jacobian from factorize_constraints, e.g. from before
+                the nodes were moved this frame. It is reused for its
+                component's steps while each one cuts the residual at least
+                tenfold, after which fresh jacobians are used. A whole network
+                factorization makes the network be solved as one system.
+            component (int, optional): Only rectify this connected component
+            pinned (Sequence[int]): Nodes the xpbd solver should hold still
+
+        Returns:
+            np.ndarray: (variable_count, 1) total change of the node coordinates
+        """
+        if self.xpbd is not None:
+            start = self.nodes.copy()
+            iterations, residual = self.xpbd.solve(self, tolerance, pinned)
+            self.last_rectify = RectifyDiagnostics(iterations, residual, residual <= tolerance)
+            # The solver sets the nodes with set_nodes, which records the move
+            return (self.nodes - start).reshape(-1, 1)
+
+        if self.rigid_bodies:
+            return self._rectify_rigid(tolerance, max_iterations, sparse)
+
+        start = self.nodes.copy()
+        if self.reduced_coordinates:
+            self._nodes[self.fixed_indices] = self.fixed_locations
+
+        if self.four_bar_loops:
+            errors = np.abs(self.constraint_errors()[:len(self.distance_lengths)])
+            for loop in self.four_bar_loops:
+                if (component is None or self.component_labels[loop.crank] == component) \
+                        and errors[loop.constraints].max() > tolerance:
+                    loop.solve(self)
+
+        if component is not None:
+            blocks = [component]
+        elif factorization is not None and factorization.component is None:
+            blocks = [None]
+        else:
+            # Only the components with a violated constraint
+            errors = self.constraint_errors(self.reduced_coordinates)
+            row_labels = self.component_labels[self.distance_indices[:, 0]]
+            if not self.reduced_coordinates:
+                row_labels = np.concatenate((row_labels, np.repeat(self.component_labels[self.fixed_indices], 2)))
+            blocks = np.unique(row_labels[np.abs(errors) > tolerance]).tolist()
+
+        self.last_rectify = RectifyDiagnostics()
+        for block in blocks:
+            block_factorization = factorization if factorization is not None and factorization.component == block else None
+            iterations, residual, factorization_steps = self._rectify_block(
+                None if block is None else self._get_block(block),
+                tolerance, max_iterations, sparse, block_factorization
+            )
+
+            self.last_rectify.factorization_steps += factorization_steps
+            self.last_rectify.iterations = max(self.last_rectify.iterations, iterations)
+            self.last_rectify.residual = max(self.last_rectify.residual, residual)
+        self.last_rectify.converged = self.last_rectify.residual <= tolerance
+
+        return self._recorded_change(start)
+
+    def _recorded_change(self, start: np.ndarray) -> np.ndarray:
+        """Records the change of the nodes since start with _nodes_moved, and
+        returns it as a (variable_count, 1) vector"""
+        change = self.nodes - start
+        self._nodes_moved(math.sqrt(np.einsum('ij,ij->i', change, change).max(initial=0.0)))
+        return change.reshape(-1, 1)
+
+    def _rectify_block(
+        self,
+        block: Union[SolverBlock, None],
+        tolerance: float,
+        max_iterations: int,
+        sparse: Union[bool, None],
+        factorization: Union[ConstraintFactorization, None]
+    ) -> Tuple[int, float, int]:
+        """Gauss-Newton iterations on a block of the solver system, or the
+        whole network if block is None. Returns the
+        iterations taken, final residual and how many of the steps used the
+        factorization."""
+        if block is None:
+            nodes = self.free_variable_indices[::2] // 2 if self.reduced_coordinates else slice(None)
+            variable_count = self.solver_variable_count
+        else:
+            nodes = block.nodes
+            variable_count = len(block.columns)
+
+        if sparse is None:
+            sparse = variable_count > LinkageNetwork.SPARSE_VARIABLE_THRESHOLD
+
+        errors = self._block_errors(block)
+        residual = float(np.abs(errors).max(initial=0.0))
+
+        iterations = 0
+        factorization_steps = 0
+        previous_residual = np.inf
+        while residual > tolerance and iterations < max_iterations:
+            if factorization is not None and residual < 0.1 * previous_residual:
+                step = factorization.solve(-errors)
+                factorization_steps += 1
+            elif sparse:
+                factorization = None
+                jacobian = self._block_jacobian(block, sparse=True)
+                # Inexact Newton: the solve only needs to be as accurate as the
+                # current residual, so early steps stop after few iterations.
+                rel_tolerance = min(0.1, residual)
+                step = scipy.sparse.linalg.lsmr(jacobian, -errors, atol=rel_tolerance, btol=rel_tolerance)[0]
+            else:
+                factorization = None
+                jacobian = self._block_jacobian(block)
+                step = np.linalg.lstsq(jacobian, -errors, rcond=None)[0]
+
+            self._nodes[nodes] += step.reshape(-1, 2)
+            iterations += 1
+
+            errors = self._block_errors(block)
+            previous_residual, residual = residual, float(np.abs(errors).max(initial=0.0))
+
+        return iterations, residual, factorization_steps
+
+    @property
+    def constraint_colors(self) -> List[np.ndarray]:
+        """Distance constraint indices grouped so that no two constraints in a
+        group share a node, letting each group be updated at once. Greedy
+        coloring; only depends on the topology, so it is cached."""
+        if self._constraint_colors is None:
+            used = [set() for _ in range(self.node_count)]
+            colors = np.empty(len(self.distance_indices), int)
+            for k, (i, j) in enumerate(self.distance_indices.tolist()):
+                taken = used[i] | used[j]
+                color = 0
+                while color in taken:
+                    color += 1
+                colors[k] = color
+                used[i].add(color)
+                used[j].add(color)
+            self._constraint_colors = [np.flatnonzero(colors == color) for color in range(colors.max(initial=-1) + 1)]
+        return self._constraint_colors
+
+    @property
+    def four_bar_loops(self) -> List[FourBarLoop]:
+        """Four-bar loops in the constraint graph: two free nodes, each joined
+        to a different fixed node, joined to each other. A free node may be
+        in at most one loop. Other constraints may still act on the loop."""
+        return self._get_four_bar_loops()[0]
+
+    def four_bar_loop(self, node: int) -> Union[FourBarLoop, None]:
+        """The four-bar loop node is the crank or rocker of, if any"""
+        return self._get_four_bar_loops()[1].get(node)
+
+    def is_closed_form(self, component: int) -> bool:
+        """Whether every distance constraint of a connected component is in
+        a four-bar loop, so the component is entirely solved in closed form"""
+        return bool(self._get_four_bar_loops()[2][component])
+
+    def _get_four_bar_loops(self) -> Tuple[List[FourBarLoop], dict, np.ndarray]:
+        """The four-bar loops, a map from crank & rocker nodes to their loop,
+        and which components are closed form. Cached with the topology."""
+        if self._four_bar_loops is None:
+            neighbors = [dict() for _ in range(self.node_count)]
+            for k, (i, j) in enumerate(self.distance_indices.tolist()):
+                neighbors[i][j] = k
+                neighbors[j][i] = k
+
+            def ground(node):
+                pivots = [(pivot, k) for pivot, k in neighbors[node].items() if pivot in self.fixed_nodes]
+                return pivots[0] if len(pivots) == 1 else (None, None)
+
+            loops = []
+            claimed = set(self.fixed_nodes)
+            for crank in range(self.node_count):
+                ground_crank, crank_bar = ground(crank)
+                if crank in claimed or ground_crank is None:
+                    continue
+                for rocker, coupler_bar in neighbors[crank].items():
+                    ground_rocker, rocker_bar = ground(rocker)
+                    if rocker in claimed or ground_rocker is None or ground_rocker == ground_crank:
+                        continue
+
+                    coupler_points = [
+                        (point, neighbors[point][crank], neighbors[point][rocker])
+                        for point in neighbors[crank]
+                        if point not in claimed and point != rocker and neighbors[point].keys() == {crank, rocker}
+                    ]
+                    loops.append(FourBarLoop(
+                        ground_crank=ground_crank,
+                        crank=crank,
+                        rocker=rocker,
+                        ground_rocker=ground_rocker,
+                        constraints=np.array(
+                            [crank_bar, coupler_bar, rocker_bar] + [k for _, *bars in coupler_points for k in bars], int
+                        ),
+                        coupler_points=coupler_points
+                    ))
+                    claimed.update(loops[-1].nodes)
+                    break
+
+            covered = np.zeros(len(self.distance_lengths), bool)
+            for loop in loops:
+                covered[loop.constraints] = True
+            closed_form = np.ones(self.component_count, bool)
+            closed_form[self.component_labels[self.distance_indices[~covered, 0]]] = False
+
+            by_node = {node: loop for loop in loops for node in (loop.crank, loop.rocker)}
+            self._four_bar_loops = loops, by_node, closed_form
+        return self._four_bar_loops
+
+    @property
+    def rigid_clusters(self) -> List[np.ndarray]:
+        """Maximal rigid clusters of three or more nodes, found with the
+        pebble game. Only depends on the topology, so it is cached."""
+        if self._rigid_clusters is None:
+            game = PebbleGame(self.node_count, self.distance_indices.tolist())
+            self._rigid_clusters = [cluster for cluster in game.rigid_clusters() if len(cluster) >= 3]
+        return self._rigid_clusters
+
+    def _get_rigid_layout(self) -> RigidBodyLayout:
+        if self._rigid_layout is None:
+            clusters = self.rigid_clusters
+            memberships = [[] for _ in range(self.node_count)]
+            for body, cluster in enumerate(clusters):
+                for node in cluster.tolist():
+                    memberships[node].append(body)
+
+            primary_bodies = np.array([bodies[0] if bodies else -1 for bodies in memberships], int)
+            point_nodes = np.flatnonzero(primary_bodies < 0)
+            shared = [(node, body) for node, bodies in enumerate(memberships) for body in bodies[1:]]
+            shared_nodes, shared_bodies = np.array(shared, int).reshape(-1, 2).T
+
+            reference_nodes = np.concatenate((np.arange(self.node_count), shared_nodes))
+            reference_bodies = np.concatenate((primary_bodies, shared_bodies))
+
+            # Points use their x column for the (always zero) angle derivative
+            point_columns = np.full(self.node_count, -1)
+            point_columns[point_nodes] = 3 * len(clusters) + 2 * np.arange(len(point_nodes))
+            reference_columns = np.where(
+                (reference_bodies >= 0)[:, np.newaxis],
+                3 * reference_bodies[:, np.newaxis] + (0, 1, 2),
+                point_columns[reference_nodes][:, np.newaxis] + (0, 1, 0),
+            )
+
+            # Bodies keep the distances between their own nodes
+            internal = np.array([
+                not set(memberships[i]).isdisjoint(memberships[j])
+                for i, j in self.distance_indices.tolist()
+            ], bool)
+            ends = self.distance_indices
+            body_constraints = [
+                np.flatnonzero(np.isin(ends[:, 0], cluster) & np.isin(ends[:, 1], cluster))
+                for cluster in clusters
+            ]
+
+            self._rigid_layout = RigidBodyLayout(
+                clusters=clusters,
+                body_constraints=body_constraints,
+                point_nodes=point_nodes,
+                reference_nodes=reference_nodes,
+                reference_bodies=reference_bodies,
+                reference_columns=reference_columns,
+                external_constraints=np.flatnonzero(~internal),
+            )
+        return self._rigid_layout
+
+    def _rectify_rigid(self, tolerance: float, max_iterations: int, sparse: Union[bool, None]) -> np.ndarray:
+        """rectify, moving each rigid cluster as a rigid body.
+
+        Each body's shape is taken from its nodes, first settled onto the
+        body's own distance constraints if those aren't met. Settling works
+        on a copy per body, so bodies sharing a node don't disturb each other;
+        the pins between the copies of shared nodes reconcile them. Only the
+        constraints between bodies, points & fixed locations are then solved,
+        over 3 variables per body rather than 2 per node.
+        """
+        layout = self._get_rigid_layout()
+        start = self.nodes.copy()
+        errors = self.constraint_errors()
+
+        body_count = len(layout.clusters)
+        shapes = []
+        settle_iterations = 0
+        for cluster, constraints in zip(layout.clusters, layout.body_constraints):
+            shape = self.nodes[cluster]
+            if np.abs(errors[constraints]).max(initial=0.0) > tolerance:
+                ends = np.searchsorted(cluster, self.distance_indices[constraints])
+                shape, iterations = LinkageNetwork._settle_shape(
+                    shape, ends, self.distance_lengths[constraints], tolerance, max_iterations
+                )
+                settle_iterations = max(settle_iterations, iterations)
+            shapes.append(shape)
+
+        if sparse is None:
+            sparse = layout.variable_count > LinkageNetwork.SPARSE_VARIABLE_THRESHOLD
+
+        # Body poses are relative to their settled shapes
+        origins = np.array([shape.mean(axis=0) for shape in shapes]).reshape(-1, 2)
+        angles = np.zeros(body_count)
+        points = self.nodes[layout.point_nodes]
+
+        is_body = layout.reference_bodies >= 0
+        ref_bodies = layout.reference_bodies[is_body]
+        local = np.empty((len(ref_bodies), 2))
+        for body, (cluster, shape) in enumerate(zip(layout.clusters, shapes)):
+            refs = ref_bodies == body
+            local[refs] = shape[np.searchsorted(cluster, layout.reference_nodes[is_body][refs])] - origins[body]
+        point_refs = np.searchsorted(layout.point_nodes, layout.reference_nodes[~is_body])
+
+        external = layout.external_constraints
+        ext_i, ext_j = self.distance_indices[external].T
+        fixed = self.fixed_indices
+        shared = np.arange(self.node_count, len(layout.reference_nodes))
+        shared_nodes = layout.reference_nodes[shared]
+
+        distance_rows = np.arange(len(external))
+        fixed_rows = len(external) + 2 * np.arange(len(fixed))
+        pin_rows = len(external) + 2 * len(fixed) + 2 * np.arange(len(shared))
+        shape = (pin_rows[-1] + 2 if len(shared) else len(external) + 2 * len(fixed), layout.variable_count)
+
+        def reference_positions():
+            positions = np.empty((len(layout.reference_nodes), 2))
+            cos, sin = np.cos(angles[ref_bodies]), np.sin(angles[ref_bodies])
+            positions[is_body] = origins[ref_bodies] + np.stack((
+                cos * local[:, 0] - sin * local[:, 1],
+                sin * local[:, 0] + cos * local[:, 1],
+            ), axis=1)
+            positions[~is_body] = points[point_refs]
+            return positions
+
+        def system(positions):
+            # Offsets from the body origins give the angle derivatives
+            offsets = np.zeros_like(positions)
+            offsets[is_body] = positions[is_body] - origins[ref_bodies]
+
+            rows, columns, values = [], [], []
+            def add(row, refs, cx, cy):
+                # Row entries of cx * dx/dq + cy * dy/dq for the references
+                rx, ry = offsets[refs, 0], offsets[refs, 1]
+                rows.append(np.repeat(row, 3))
+                columns.append(layout.reference_columns[refs].ravel())
+                values.append(np.stack(np.broadcast_arrays(cx, cy, cy * rx - cx * ry), axis=1).ravel())
+
+            deltas = positions[ext_j] - positions[ext_i]
+            distances = np.hypot(deltas[:, 0], deltas[:, 1])
+            units = deltas / np.where(distances > 0, distances, 1.0)[:, np.newaxis]
+            add(distance_rows, ext_j, units[:, 0], units[:, 1])
+            add(distance_rows, ext_i, -units[:, 0], -units[:, 1])
+
+            add(fixed_rows, fixed, 1.0, 0.0)
+            add(fixed_rows + 1, fixed, 0.0, 1.0)
+
+            add(pin_rows, shared, 1.0, 0.0)
+            add(pin_rows, shared_nodes, -1.0, 0.0)
+            add(pin_rows + 1, shared, 0.0, 1.0)
+            add(pin_rows + 1, shared_nodes, 0.0, -1.0)
+
+            errors = np.concatenate((
+                distances - self.distance_lengths[external],
+                (positions[fixed] - self.fixed_locations).ravel(),
+                (positions[shared] - positions[shared_nodes]).ravel(),
+            ))
+            jacobian = scipy.sparse.csr_matrix(
+                (np.concatenate(values), (np.concatenate(rows), np.concatenate(columns))),
+                shape=shape
+            )
+            return errors, jacobian
+
+        positions = reference_positions()
+        errors, jacobian = system(positions)
+        residual = float(np.abs(errors).max(initial=0.0))
+
+        # A shared node's pin error adds to its bodies' constraint errors
+        body_tolerance = 0.5 * tolerance
+
+        iterations = 0
+        while residual > body_tolerance and iterations < max_iterations:
+            if sparse:
+                rel_tolerance = min(0.1, residual)
+                step = scipy.sparse.linalg.lsmr(jacobian, -errors, atol=rel_tolerance, btol=rel_tolerance)[0]
+            else:
+                step = np.linalg.lstsq(jacobian.toarray(), -errors, rcond=None)[0]
+
+            body_steps = step[:3 * body_count].reshape(-1, 3)
+            origins += body_steps[:, :2]
+            angles += body_steps[:, 2]
+            points += step[3 * body_count:].reshape(-1, 2)
+            iterations += 1
+
+            positions = reference_positions()
+            errors, jacobian = system(positions)
+            residual = float(np.abs(errors).max(initial=0.0))
+
+        self._nodes[:] = positions[:self.node_count]
+
+        residual = float(np.abs(self.constraint_errors()).max(initial=0.0))
+        self.last_rectify = RectifyDiagnostics(max(settle_iterations, iterations), residual, residual <= tolerance)
+        return self._recorded_change(start)
+
+    @staticmethod
+    def _settle_shape(
+        positions: np.ndarray,
+        ends: np.ndarray,
+        lengths: np.ndarray,
+        tolerance: float,
+        max_iterations: int
+    ) -> Tuple[np.ndarray, int]:
+        """Gauss-Newton on a standalone set of points & distance constraints.
+
+        Args:
+            positions (np.ndarray): (K, 2) starting positions, left unchanged
+            ends (np.ndarray): (C, 2) indices into positions of each constraint
+            lengths (np.ndarray): (C,) constraint lengths
+
+        Returns:
+            Tuple[np.ndarray, int]: settled positions and iterations taken
+        """
+        positions = positions.copy()
+        rows = np.repeat(np.arange(len(ends)), 4)
+        columns = (2 * ends[:, :, np.newaxis] + (0, 1)).ravel()
+        shape = (len(ends), positions.size)
+
+        for iterations in range(max_iterations + 1):
+            deltas = positions[ends[:, 1]] - positions[ends[:, 0]]
+            distances = np.hypot(deltas[:, 0], deltas[:, 1])
+            errors = distances - lengths
+            residual = np.abs(errors).max(initial=0.0)
+            if residual <= tolerance or iterations == max_iterations:
+                break
+
+            units = deltas / np.where(distances > 0, distances, 1.0)[:, np.newaxis]
+            values = np.stack((-units, units), axis=1).ravel()
+            jacobian = scipy.sparse.csr_matrix((values, (rows, columns)), shape=shape)
+
+            if positions.size > LinkageNetwork.SPARSE_VARIABLE_THRESHOLD:
+                rel_tolerance = min(0.1, residual)
+                step = scipy.sparse.linalg.lsmr(jacobian, -errors, atol=rel_tolerance, btol=rel_tolerance)[0]
+            else:
+                step = np.linalg.lstsq(jacobian.toarray(), -errors, rcond=None)[0]
+            positions += step.reshape(-1, 2)
+
+        return positions, iterations
+
+    def factorize_constraints(self, component: Union[int, None] = None, sparse: Union[bool, None] = None) -> ConstraintFactorization:
+        """Factorizes the solver_jacobian of the whole network, or of one
+        connected component.
+
+        Args:
+            component (int, optional): Only factorize this connected component
+            sparse (bool, optional): Factorize the sparse jacobian
+                (SparseConstraintFactorization) rather than take the SVD of
+                the dense one. By default, sparse above
+                SPARSE_VARIABLE_THRESHOLD variables, as in rectify.
+        """
+        if sparse is None:
+            variable_count = self.solver_variable_count if component is None else len(self._get_block(component).columns)
+            sparse = variable_count > LinkageNetwork.SPARSE_VARIABLE_THRESHOLD
+        if sparse:
+            return SparseConstraintFactorization(self.solver_jacobian(component, sparse=True), component=component)
+        return ConstraintFactorization(self.solver_jacobian(component), component=component)
+
+    def constraint_errors(self, reduced: bool = False) -> np.ndarray:
+        """Error of every constraint, in the same order as the jacobian rows.
+
+        Distance errors are the signed difference between the current and
+        constrained length; fixed errors are the x & y offsets from the
+        fixed location.
+
+        Args:
+            reduced (bool): Only return the distance errors, matching the rows
+                of the reduced jacobian
+
+        Returns:
+            np.ndarray: (constraint_count,) errors, or (distance count,) if reduced
+        """
+        distance_errors = self._distance_errors()
+        if reduced:
+            return distance_errors
+        fixed_errors = self.nodes[self.fixed_indices] - self.fixed_locations
+        return np.concatenate((distance_errors, fixed_errors.ravel()))
+
+    def _distance_errors(self, distances: Union[np.ndarray, slice] = slice(None)) -> np.ndarray:
+        """Errors of some of the distance constraints, by default all"""
+        ends = self.distance_indices[distances]
+        deltas = self.nodes[ends[:, 1]] - self.nodes[ends[:, 0]]
+        return np.hypot(deltas[:, 0], deltas[:, 1]) - self.distance_lengths[distances]
+
+    @property
+    def constraint_count(self) -> int:
+        """Number of rows in the constraint jacobian"""
+        return len(self.distance_lengths) + 2 * len(self.fixed_indices)
+
+    def constraint_jacobian(self, sparse: bool = False, normalized: bool = False, reduced: bool = False) -> Union[np.ndarray, scipy.sparse.csr_matrix]:
+        """Jacobian of the constraints with respect to the node coordinates.
+
+        Rows are the distance constraints followed by two rows (x, y) per
+        fixed constraint; see distance_constraint_partial_derivs and
+        fixed_constraint_partial_derivs for the entries.
+
+        Args:
+            sparse (bool): Return a scipy.sparse CSR matrix instead of a dense array
+            normalized (bool): Divide the distance rows by the current distance,
+                giving the derivatives of the distance itself (matching
+                constraint_errors) rather than of half its square
+            reduced (bool): Only include the distance rows and the columns of
+                free_variable_indices, treating fixed nodes as constants
+
+        Returns:
+            (constraint_count, variable_count) jacobian, or
+                (distance count, free variable count) if reduced
+        """
+        return LinkageNetwork._assemble_jacobian(self._get_jacobian_pattern(reduced), self._jacobian_values(normalized), sparse)
+
+    @staticmethod
+    def _assemble_jacobian(pattern: Tuple, values: np.ndarray, sparse: bool) -> Union[np.ndarray, scipy.sparse.csr_matrix]:
+        """Places the jacobian values kept by a _csr_pattern"""
+        entries, rows, cols, perm, indices, indptr, shape = pattern
+        values = values[entries]
+
+        if not sparse:
+            jacobian = np.zeros(shape)
+            jacobian[rows, cols] = values
+            return jacobian
+
+        return scipy.sparse.csr_matrix((values[perm], indices, indptr), shape=shape)
+
+    def _jacobian_values(
+        self,
+        normalized: bool = False,
+        distances: Union[np.ndarray, slice] = slice(None),
+        fixed_count: Union[int, None] = None
+    ) -> np.ndarray:
+        """Nonzero jacobian entries, in the order of _get_jacobian_pattern's
+        rows & cols. Optionally only those of some distance constraints,
+        followed by those of fixed_count fixed constraints."""
+        ends = self.distance_indices[distances]
+        deltas = self.nodes[ends[:, 0]] - self.nodes[ends[:, 1]]
+        if normalized:
+            lengths = np.hypot(deltas[:, 0], deltas[:, 1])
+            deltas = deltas / np.where(lengths > 0, lengths, 1.0)[:, np.newaxis]
+        if fixed_count is None:
+            fixed_count = len(self.fixed_indices)
+        values = np.empty(4 * len(deltas) + 2 * fixed_count)
+        distance_values = values[:4 * len(deltas)].reshape(-1, 2, 2)
+        distance_values[:, 0] = deltas     # dg/dxi, dg/dyi
+        distance_values[:, 1] = -deltas    # dg/dxj, dg/dyj
+        values[4 * len(deltas):] = 1
+        return values
+
+    def _get_jacobian_pattern(self, reduced: bool = False):
+        """Which of _jacobian_values are kept, their rows & columns, plus the
+        CSR structure they map to and the jacobian's shape. Only depends on
+        the topology, so it is cached."""
+        if reduced:
+            if self._reduced_jacobian_pattern is None:
+                _, rows, cols, _, _, _, _ = self._get_jacobian_pattern()
+                distance_count = len(self.distance_lengths)
+
+                # Drop the fixed rows, and the entries in fixed node columns
+                column_map = np.full(self.variable_count, -1)
+                column_map[self.free_variable_indices] = np.arange(len(self.free_variable_indices))
+                entries = np.flatnonzero((rows < distance_count) & (column_map[cols] >= 0))
+
+                shape = (distance_count, len(self.free_variable_indices))
+                self._reduced_jacobian_pattern = LinkageNetwork._csr_pattern(
+                    entries, rows[entries], column_map[cols[entries]], shape
+                )
+            return self._reduced_jacobian_pattern
+
+        if self._jacobian_pattern is None:
+            distance_count = len(self.distance_lengths)
+            fixed_count = len(self.fixed_indices)
+
+            distance_rows = np.repeat(np.arange(distance_count), 4)
+            distance_cols = (2 * self.distance_indices[:, :, np.newaxis] + (0, 1)).ravel()
+            fixed_rows = distance_count + np.arange(2 * fixed_count)
+            fixed_cols = (2 * self.fixed_indices[:, np.newaxis] + (0, 1)).ravel()
+
+            rows = np.concatenate((distance_rows, fixed_rows))
+            cols = np.concatenate((distance_cols, fixed_cols))
+
+            shape = (self.constraint_count, self.variable_count)
+            self._jacobian_pattern = LinkageNetwork._csr_pattern(slice(None), rows, cols, shape)
+        return self._jacobian_pattern
+
+    @staticmethod
+    def _csr_pattern(entries, rows: np.ndarray, cols: np.ndarray, shape: Tuple[int, int]):
+        # Let scipy order the entries, tracking where each one ends up
+        order = scipy.sparse.csr_matrix(
+            (np.arange(1, len(rows) + 1), (rows, cols)),
+            shape=shape
+        )
+        order.sort_indices()
+        perm = order.data - 1
+        return entries, rows, cols, perm, order.indices, order.indptr, shape
     
     def fixed_constraint_partial_derivs(self, constraint_index: int) -> np.array:
 
@@ -145,7 +1210,7 @@ class LinkageNetwork(Linkage):
         # 
         # Another way to put this: we include row in the jacobian 
         # that forces the x and y variables for this node not to change 
-        node_i, _ = self.fixed_constraints[constraint_index]
+        node_i = self.fixed_indices[constraint_index]
 
         partials_x = np.zeros(self.variable_count)
         partials_x[node_i*2] = 1
@@ -168,7 +1233,7 @@ class LinkageNetwork(Linkage):
         #    dg/dxi = 2(xi - xj)
         #    dg/dyj = 2(yj - yi)
         #    dg/dyi = 2(yi - yj)
-        i, j, _ = self.distance_constraints[constraint_index]
+        i, j = self.distance_indices[constraint_index]
         xi, yi = self.nodes[i]
         xj, yj = self.nodes[j]
         
@@ -181,17 +1246,51 @@ class LinkageNetwork(Linkage):
         return partials
         
     def distance_constraint_error(self, constraint_index: int) -> float:
-        i, j, constraint_distance = self.distance_constraints[constraint_index]
+        i, j = self.distance_indices[constraint_index]
+        constraint_distance = self.distance_lengths[constraint_index]
         node_i = self.nodes[i]
         node_j = self.nodes[j]
         return np.linalg.norm(node_j - node_i) - constraint_distance
 
     def fixed_consraint_error(self, constraint_index: int) -> Tuple[float, float]:
-        i, fixed_loc = self.fixed_constraints[constraint_index]
+        i = self.fixed_indices[constraint_index]
         nodex, nodey = self.nodes[i]
-        fixedx, fixedy = np.array(fixed_loc)
+        fixedx, fixedy = self.fixed_locations[constraint_index]
         return nodex - fixedx, nodey - fixedy
 
+def lattice_network(rows: int, cols: int, braces: int = 0, **kwargs) -> LinkageNetwork:
+    """A rows x cols grid of nodes one unit apart, each joined to its
+    horizontal & vertical neighbours, with the left column fixed. Node
+    r * cols + c starts at (c, r). Used by the self-checks, and not part of
+    the model package's exports.
+
+    Args:
+        braces (int): Also brace every braces'th cell along its diagonal,
+            or none if 0. Bracing every cell makes the lattice rigid.
+        kwargs: Passed on to the LinkageNetwork constructor
+
+    Returns:
+        LinkageNetwork: the lattice, satisfying all its constraints
+    """
+    grid = np.stack(np.meshgrid(np.arange(cols), np.arange(rows)), axis=-1).reshape(-1, 2).astype(float)
+    index = np.arange(rows * cols).reshape(rows, cols)
+    edges = [
+        np.stack((index[:, :-1].ravel(), index[:, 1:].ravel()), axis=1),
+        np.stack((index[:-1].ravel(), index[1:].ravel()), axis=1),
+    ]
+    if braces:
+        edges.append(np.stack((index[:-1, :-1].ravel(), index[1:, 1:].ravel()), axis=1)[::braces])
+    edges = np.concatenate(edges)
+    lengths = np.linalg.norm(grid[edges[:, 1]] - grid[edges[:, 0]], axis=1)
+
+    return LinkageNetwork(
+        nodes=grid,
+        distance_constraints=[(i, j, length) for (i, j), length in zip(edges.tolist(), lengths.tolist())],
+        fixed_constraints=[(i, grid[i]) for i in index[:, 0]],
+        bounds=(-1, cols, -1, rows),
+        **kwargs
+    )
+
 if __name__ == "__main__":
 
     import matplotlib.pyplot as plt
@@ -223,6 +1322,157 @@ if __name__ == "__main__":
         bounds=(-1.1, 3.1, -1.1, 2.1)
     )
 
+    # The vectorized jacobian matches the row by row partial derivatives
+    network.move_nodes(np.random.uniform(-0.1, 0.1, network.nodes.shape))
+    network.fixed_constraints = [(0, (0, 0)), (3, (2, 1))]
+    assert network.fixed_constraints == ((0, (0.0, 0.0)), (3, (2.0, 1.0)))
+    assert network.distance_constraints[-1] == (1, 4, 1.0)
+    # The constraints can only be changed by replacing them all
+    try:
+        network.distance_constraints[0] = (0, 1, 2)
+        assert False
+    except TypeError:
+        pass
+    expected = np.array(
+        [network.distance_constraint_partial_derivs(i) for i in range(len(network.distance_lengths))] +
+        [row for i in range(len(network.fixed_indices)) for row in network.fixed_constraint_partial_derivs(i)]
+    )
+    assert np.allclose(network.constraint_jacobian(), expected)
+    assert np.allclose(network.constraint_jacobian(sparse=True).toarray(), expected)
+
+    # Reduced coordinates keep the distance rows & free node columns
+    free = network.free_variable_indices
+    reduced_expected = expected[:len(network.distance_lengths)][:, free]
+    assert np.allclose(network.constraint_jacobian(reduced=True), reduced_expected)
+    assert np.allclose(network.constraint_jacobian(sparse=True, reduced=True).toarray(), reduced_expected)
+    assert np.allclose(network.to_full(network.to_reduced(np.arange(12.0)))[free], free)
+
+    errors = np.concatenate((
+        [network.distance_constraint_error(i) for i in range(len(network.distance_lengths))],
+        np.ravel([network.fixed_consraint_error(i) for i in range(len(network.fixed_indices))])
+    ))
+    assert np.allclose(network.constraint_errors(), errors)
+
+    violation = network.constraint_violation(tolerance=0.05)
+    assert np.isclose(violation.max_error, np.abs(errors).max())
+    assert np.isclose(violation.rms_error, np.sqrt(np.mean(errors ** 2)))
+    assert violation.satisfied == network.satisfies_all_constraints(tolerance=0.05)
+    for i in range(len(network.distance_lengths)):
+        assert network.satisfies_distance_constraint(i, 0.05) == (i not in violation.violated_distance_constraints)
+    for i in range(len(network.fixed_indices)):
+        assert network.satisfies_fixed_constraint(i, 0.05) == (i not in violation.violated_fixed_constraints)
+
+    # Spatial queries match brute force, before & after the nodes move, by
+    # assignment, rectification or small tracked moves that keep the index
+    for move in (None, "assign", "rectify", "small"):
+        if move == "assign":
+            network.nodes = network.nodes + np.random.uniform(-0.05, 0.05, network.nodes.shape)
+        elif move == "rectify":
+            network.rectify()
+        elif move == "small":
+            index = network._spatial_index
+            network.move_nodes(np.random.uniform(-0.01, 0.01, network.nodes.shape))
+            network.set_nodes(network.nodes[1] + (0.01, 0), 1)
+        free = [i for i in range(network.node_count) if not network.is_fixed_node(i)]
+        for point in np.random.uniform(-1, 3, (20, 2)):
+            distances = np.linalg.norm(network.nodes[free] - point, axis=1)
+            assert network.nearest_node(point) == free[np.argmin(distances)]
+            assert np.array_equal(network.nodes_within(point, 1.0), np.array(free)[distances <= 1.0])
+        if move == "small":
+            assert network._spatial_index is index
+
+    # The nodes can't be moved behind the spatial index's back
+    try:
+        network.nodes[2] = (-2, 2)
+        assert False
+    except ValueError:
+        pass
+    moved_from = network.nodes[2].copy()
+    network.set_nodes([(-2, 2)], [2])
+    assert network.nearest_node((-2, 2)) == 2
+    network.set_nodes(moved_from, 2)
+
+    # Disjoint copies of the network are separate components, and only the
+    # perturbed one is re-solved
+    count = network.node_count
+    copies = LinkageNetwork(
+        nodes=np.concatenate((network.nodes, network.nodes + (4, 0))),
+        distance_constraints=[*network.distance_constraints, *((i + count, j + count, l) for i, j, l in network.distance_constraints)],
+        fixed_constraints=[],
+        bounds=(-1, 7, -1, 2)
+    )
+    assert copies.component_count == 2
+    copies.rectify()
+    rectified = copies.nodes.copy()
+    copies.move_nodes(np.concatenate((np.zeros((count, 2)), np.random.uniform(-0.05, 0.05, (count, 2)))))
+    changes = copies.rectify()
+    assert copies.last_rectify.converged
+    assert np.array_equal(copies.nodes[:count], rectified[:count])
+    assert not np.any(changes[:2 * count])
+
+    # Each component's part of the solver system is evaluated on its own,
+    # matching that part of the whole network's
+    copies.fixed_constraints = [(count, tuple(copies.nodes[count])), (1, tuple(copies.nodes[1] + 0.01))]
+    for reduced in (False, True):
+        copies.reduced_coordinates = reduced
+        errors, jacobian = copies.solver_errors(), copies.solver_jacobian()
+        for component in range(copies.component_count):
+            block = copies._get_block(component)
+            assert np.allclose(copies.solver_errors(component), errors[block.rows])
+            assert np.allclose(copies.solver_jacobian(component), jacobian[np.ix_(block.rows, block.columns)])
+            assert np.allclose(copies.solver_jacobian(component, sparse=True).toarray(), jacobian[np.ix_(block.rows, block.columns)])
+
+    # A braced square (0-3), fixed to the ground, drives another (4-7)
+    # through two bars. A triangle (7, 8, 9) hinges on the second square, and
+    # a free node (10) hangs off the triangle.
+    truss = LinkageNetwork(
+        nodes=[(0, 0), (1, 0), (1, 1), (0, 1), (2, 1), (3, 1), (3, 2), (2, 2), (2, 3), (1, 3), (0, 3)],
+        distance_constraints=[
+            (0, 1, 1), (1, 2, 1), (2, 3, 1), (3, 0, 1), (0, 2, np.sqrt(2)),
+            (4, 5, 1), (5, 6, 1), (6, 7, 1), (7, 4, 1), (4, 6, np.sqrt(2)),
+            (2, 4, 1), (1, 5, np.sqrt(5)),
+            (7, 8, 1), (8, 9, 1), (9, 7, np.sqrt(2)),
+            (9, 10, 1),
+        ],
+        fixed_constraints=[(0, (0, 0)), (1, (1, 0))],
+        bounds=(-1, 4, -1, 4),
+        rigid_bodies=True
+    )
+    assert sorted(c.tolist() for c in truss.rigid_clusters) == [[0, 1, 2, 3], [4, 5, 6, 7], [7, 8, 9]]
+    truss.move_nodes(np.random.uniform(-0.05, 0.05, truss.nodes.shape))
+    truss.rectify()
+    assert truss.last_rectify.converged, truss.last_rectify
+    assert truss.satisfies_all_constraints(tolerance=1e-9)
+
+    # The factorization projects onto the same nullspace as scipy's SVD
+    import scipy.linalg
+    nullspace = scipy.linalg.null_space(network.constraint_jacobian())
+    action = np.random.uniform(-1, 1, network.variable_count)
+    projected = network.factorize_constraints().project_onto_nullspace(action)
+    assert np.allclose(projected, nullspace @ (nullspace.T @ action))
+
+    # The sparse factorization matches the SVD on a lattice with redundant
+    # constraints, for both the projection and the minimum norm solve
+    lattice = lattice_network(15, 15, braces=1)
+    dense = lattice.factorize_constraints(sparse=False)
+    sparse_factorization = lattice.factorize_constraints()
+    assert isinstance(sparse_factorization, SparseConstraintFactorization)
+    action = np.random.uniform(-1, 1, lattice.variable_count)
+    assert np.allclose(sparse_factorization.project_onto_nullspace(action), dense.project_onto_nullspace(action), atol=1e-6)
+    rhs = lattice.solver_jacobian() @ action
+    assert np.allclose(sparse_factorization.solve(rhs), dense.solve(rhs), atol=1e-6)
+
+    # Dense & sparse rectification both converge on a perturbed lattice
+    # with a fixed left column
+    for sparse, reduced in ((False, False), (True, False), (False, True), (True, True)):
+        lattice = lattice_network(15, 15, braces=1, reduced_coordinates=reduced)
+        assert lattice.satisfies_all_constraints(tolerance=1e-12)
+        lattice.move_nodes(np.random.uniform(-0.02, 0.02, lattice.nodes.shape))
+        assert not lattice.satisfies_all_constraints()
+        lattice.rectify(tolerance=1e-8, sparse=sparse)
+        assert lattice.last_rectify.converged, lattice.last_rectify
+        assert lattice.satisfies_all_constraints(tolerance=1e-8)
+
     fig, ax = plt.subplots()
     network.draw(ax, None)
     ax.set_xlim(-1, 3)
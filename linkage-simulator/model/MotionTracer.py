@@ -0,0 +1,296 @@
+from dataclasses import dataclass
+from typing import Literal, Tuple, Union
+import math
+
+import numpy as np
+import scipy.linalg
+import scipy.sparse
+import scipy.sparse.linalg
+
+# A node, or a (pivot, node) crank whose angle drives the mechanism
+Driver = Union[int, Tuple[int, int]]
+
+@dataclass
+class MotionTrace:
+    """The motion of a one degree of freedom LinkageNetwork, from MotionTracer"""
+    paths: np.ndarray           # (steps, N, 2) node positions at each step
+    arc_lengths: np.ndarray     # (steps,) distance travelled in configuration space
+    # (steps,) the driving crank's angle, unwrapped, or the distance the
+    # driving node has travelled. Runs backwards between dead points.
+    drive: np.ndarray
+    dead_points: np.ndarray     # Steps at which the driver turned back
+    # "closed" once back at the start, so the paths hold one full cycle,
+    # "max_steps" if the step budget ran out first, or "stalled" if the
+    # steps shrank below the smallest allowed, e.g. at a bifurcation
+    termination: Literal["closed", "max_steps", "stalled"]
+
+    @property
+    def closed(self) -> bool:
+        return self.termination == "closed"
+
+@dataclass
+class MotionTracer:
+    """Traces the motion of a one degree of freedom LinkageNetwork by
+    pseudo-arclength predictor-corrector continuation, without drawing.
+
+    Each step predicts along the tangent of the motion, the nullspace of the
+    constraint jacobian, then corrects back onto the constraints with Newton
+    steps restricted to the plane normal to the tangent. Steps grow while the
+    corrector converges quickly and shrink when it fails or the tangent turns
+    too sharply. Following the arclength rather than the driver carries the
+    trace through the driver's dead points.
+
+    Step sizes are in configuration space (the norm over all free node
+    coordinates), relative to the mean distance constraint length.
+    """
+    step: float = 0.05
+    min_step: float = 1e-5
+    max_step: float = 0.25
+    max_steps: int = 10000
+    # Largest constraint error of each traced configuration
+    tolerance: float = 1e-10
+    # Most Newton steps per corrector before the step is retried smaller
+    corrector_iterations: int = 5
+    # Largest change of the tangent over one step, in radians
+    max_turn: float = 0.2
+
+    def trace(self, network, driver: Driver, reverse: bool = False) -> MotionTrace:
+        """Traces the network's motion from its current configuration until
+        it returns there. The network's nodes are left unchanged.
+
+        Args:
+            network (LinkageNetwork): network with one degree of freedom once
+                its fixed nodes are held
+            driver: node, or (pivot, node) crank, whose motion sets the
+                direction of travel and is recorded in MotionTrace.drive
+            reverse (bool): Start with the crank turning clockwise rather than
+                counterclockwise, or the node moving left rather than right
+                (down rather than up, if it starts moving vertically)
+
+        Returns:
+            MotionTrace: the traced motion
+        """
+        start = network.nodes.copy()
+        try:
+            return self._trace(network, driver, reverse)
+        finally:
+            network.nodes = start
+
+    def _trace(self, network, driver: Driver, reverse: bool) -> MotionTrace:
+        free = network.free_variable_indices
+        scale = float(network.distance_lengths.mean()) if len(network.distance_lengths) else 1.0
+        sparse = len(free) > network.SPARSE_VARIABLE_THRESHOLD
+
+        network.set_nodes(network.fixed_locations, network.fixed_indices)
+        network.rectify(tolerance=self.tolerance)
+        if not network.last_rectify.converged:
+            raise ValueError("Starting configuration doesn't satisfy the constraints")
+
+        nullspace = scipy.linalg.null_space(network.constraint_jacobian(normalized=True, reduced=True))
+        if nullspace.shape[1] != 1:
+            raise ValueError(f"Mechanism has {nullspace.shape[1]} degrees of freedom rather than one")
+        tangent = nullspace[:, 0]
+
+        crank = np.ndim(driver) != 0
+        rate = self._driver_rate(network, driver, tangent)
+        if crank:
+            flip = rate < 0
+        else:
+            flip = rate[0] < 0 or (rate[0] == 0 and rate[1] < 0)
+        if flip != reverse:
+            tangent = -tangent
+            rate = -rate
+
+        x = network.nodes.ravel()[free]
+        start, start_tangent = x.copy(), tangent.copy()
+        paths = [network.nodes.copy()]
+        arc_lengths = [0.0]
+        drive = [self._driver_angle(network, driver) if crank else 0.0]
+        dead_points = []
+        direction = 1.0
+
+        step = self.step * scale
+        termination = "max_steps"
+        while len(paths) < self.max_steps:
+            corrected = self._correct(network, free, x, x + step * tangent, tangent, sparse)
+            if corrected is not None:
+                next_tangent = self._next_tangent(network, tangent, sparse)
+                if next_tangent is None or next_tangent @ tangent < math.cos(self.max_turn):
+                    corrected = None
+
+            if corrected is None:
+                self._set(network, free, x)
+                step /= 2
+                if step < self.min_step * scale:
+                    termination = "stalled"
+                    break
+                continue
+
+            next_x, iterations = corrected
+            next_rate = self._driver_rate(network, driver, next_tangent)
+            if crank:
+                turned = rate * next_rate < 0
+                angle = self._driver_angle(network, driver)
+                drive.append(drive[-1] + math.remainder(angle - drive[-1], 2 * math.pi))
+            else:
+                turned = rate @ next_rate < 0
+                if turned:
+                    direction = -direction
+                drive.append(drive[-1] + direction * float(np.linalg.norm(network.nodes[driver] - paths[-1][driver])))
+            if turned:
+                dead_points.append(len(paths))
+
+            arc_lengths.append(arc_lengths[-1] + float(np.linalg.norm(next_x - x)))
+            paths.append(network.nodes.copy())
+            x, tangent, rate = next_x, next_tangent, next_rate
+
+            # Back within a step of the start, heading the same way
+            if arc_lengths[-1] > 3 * step and np.linalg.norm(x - start) < step and tangent @ start_tangent > 0:
+                termination = "closed"
+                break
+
+            if iterations <= 2:
+                step = min(1.5 * step, self.max_step * scale)
+
+        return MotionTrace(
+            paths=np.array(paths),
+            arc_lengths=np.array(arc_lengths),
+            drive=np.array(drive),
+            dead_points=np.array(dead_points, int),
+            termination=termination
+        )
+
+    def _correct(
+        self,
+        network,
+        free: np.ndarray,
+        x: np.ndarray,
+        predicted: np.ndarray,
+        tangent: np.ndarray,
+        sparse: bool
+    ) -> Union[Tuple[np.ndarray, int], None]:
+        """Newton iterations from the predicted point back onto the
+        constraints, within the plane through it normal to the tangent.
+        Returns the corrected point and iterations taken, or None."""
+        corrected = predicted.copy()
+        for iterations in range(self.corrector_iterations + 1):
+            self._set(network, free, corrected)
+            errors = np.append(network.constraint_errors(reduced=True), tangent @ (corrected - predicted))
+            if np.abs(errors).max() <= self.tolerance:
+                # Guard against jumping onto another part of the motion
+                if np.linalg.norm(corrected - predicted) > np.linalg.norm(predicted - x):
+                    return None
+                return corrected, iterations
+            if iterations == self.corrector_iterations:
+                break
+
+            step = self._bordered_solve(network, tangent, errors, sparse)
+            if step is None:
+                break
+            corrected -= step
+        return None
+
+    def _next_tangent(self, network, tangent: np.ndarray, sparse: bool) -> Union[np.ndarray, None]:
+        """Tangent of the motion at the current configuration, on the same
+        side as the previous tangent. It solves J t = 0, t . tangent = 1."""
+        rhs = np.zeros(len(network.distance_lengths) + 1)
+        rhs[-1] = 1
+        next_tangent = self._bordered_solve(network, tangent, rhs, sparse)
+        if next_tangent is None:
+            return None
+        return next_tangent / np.linalg.norm(next_tangent)
+
+    @staticmethod
+    def _bordered_solve(network, tangent: np.ndarray, rhs: np.ndarray, sparse: bool) -> Union[np.ndarray, None]:
+        """Solves the jacobian bordered by the tangent as a row. With one
+        degree of freedom and no redundant constraints it is square, and
+        singular only where the motion bifurcates (returning None there).
+        Otherwise it is solved in the least squares sense."""
+        jacobian = network.constraint_jacobian(sparse=sparse, normalized=True, reduced=True)
+        square = jacobian.shape[0] + 1 == jacobian.shape[1]
+        try:
+            if sparse:
+                system = scipy.sparse.vstack((jacobian, tangent[np.newaxis])).tocsc()
+                if not square:
+                    return scipy.sparse.linalg.lsmr(system, rhs, atol=1e-14, btol=1e-14)[0]
+                solution = scipy.sparse.linalg.splu(system).solve(rhs)
+            else:
+                system = np.vstack((jacobian, tangent))
+                if not square:
+                    return np.linalg.lstsq(system, rhs, rcond=None)[0]
+                solution = np.linalg.solve(system, rhs)
+        except (RuntimeError, np.linalg.LinAlgError):
+            return None
+        return solution if np.all(np.isfinite(solution)) else None
+
+    @staticmethod
+    def _driver_rate(network, driver: Driver, tangent: np.ndarray) -> Union[float, np.ndarray]:
+        """Rate of the driver's motion along the tangent: the crank's angular
+        rate, or the driving node's velocity"""
+        velocities = network.to_full(tangent).reshape(-1, 2)
+        if np.ndim(driver) == 0:
+            return velocities[driver].copy()
+
+        pivot, node = driver
+        arm = network.nodes[node] - network.nodes[pivot]
+        velocity = velocities[node] - velocities[pivot]
+        return float((arm[0] * velocity[1] - arm[1] * velocity[0]) / (arm @ arm))
+
+    @staticmethod
+    def _driver_angle(network, driver: Tuple[int, int]) -> float:
+        pivot, node = driver
+        dx, dy = network.nodes[node] - network.nodes[pivot]
+        return math.atan2(dy, dx)
+
+    @staticmethod
+    def _set(network, free: np.ndarray, x: np.ndarray):
+        positions = network.nodes.ravel().copy()
+        positions[free] = x
+        network.nodes = positions.reshape(-1, 2)
+
+if __name__ == "__main__":
+
+    from .LinkageNetwork import LinkageNetwork
+
+    # Grashof crank-rocker: ground 4, crank 1, coupler 3, rocker 3.5, with a
+    # coupler point
+    crank_rocker = LinkageNetwork(
+        nodes=[(0, 0), (1, 0), (3.7097, 1.2844), (4, 0), (1.8549, 2.2)],
+        distance_constraints=[(0, 1, 1), (1, 2, 3), (2, 3, 3.5), (1, 4, 2), (2, 4, 2)],
+        fixed_constraints=[(0, (0, 0)), (3, (4, 0))],
+        bounds=(-2, 6, -3, 6)
+    )
+    crank_rocker.rectify()
+    start = crank_rocker.nodes.copy()
+
+    tracer = MotionTracer()
+    cycle = tracer.trace(crank_rocker, (0, 1))
+    assert cycle.closed and len(cycle.dead_points) == 0
+    assert np.array_equal(crank_rocker.nodes, start)
+    assert cycle.paths.shape == (len(cycle.drive), 5, 2)
+    # The crank turns once, counterclockwise
+    assert np.all(np.diff(cycle.drive) > 0)
+    assert 2 * np.pi - 0.3 < cycle.drive[-1] - cycle.drive[0] < 2 * np.pi
+    for nodes in cycle.paths:
+        crank_rocker.nodes = nodes
+        assert crank_rocker.satisfies_all_constraints(tolerance=1e-9)
+    crank_rocker.nodes = start
+
+    # Driven by the rocker, the same cycle has the rocker turn back at both
+    # of its limits
+    rocker_cycle = tracer.trace(crank_rocker, (3, 2))
+    assert rocker_cycle.closed and len(rocker_cycle.dead_points) == 2
+    assert np.isclose(rocker_cycle.arc_lengths[-1], cycle.arc_lengths[-1], rtol=0.05)
+
+    # A five-bar has two degrees of freedom
+    five_bar = LinkageNetwork(
+        nodes=[(0, 0), (0, 1), (1, 2), (2, 1), (2, 0)],
+        distance_constraints=[(0, 1, 1), (1, 2, np.sqrt(2)), (2, 3, np.sqrt(2)), (3, 4, 1)],
+        fixed_constraints=[(0, (0, 0)), (4, (2, 0))],
+        bounds=(-1, 3, -1, 3)
+    )
+    try:
+        tracer.trace(five_bar, 2)
+        assert False
+    except ValueError:
+        pass
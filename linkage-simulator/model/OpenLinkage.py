@@ -15,6 +15,13 @@ class OpenLinkage(Linkage):
 
     EQUALITY_THRESHOLD: float = 0.01
     EQUALITY_THRESHOLD_SQUARED: float = 0.01 * 0.01
+
+    __slots__ = (
+        'links', 'link_minangles', 'link_maxangles', 'link_maxspeeds', 'link_maxaccels',
+        '_link_array', '_angles', '_angles_view',
+        # Derived from the angles, computed on demand & cleared when they change
+        '_absolute_angles', '_points',
+    )
     
     def __init__(
         self, 
@@ -28,6 +35,7 @@ class OpenLinkage(Linkage):
 
         self.links = tuple(link_sizes)
         assert len(self.links) > 0
+        self._link_array = np.array(self.links, float)
 
         # test if link_minangles and link_maxangles are iterable
         try:
@@ -53,20 +61,31 @@ class OpenLinkage(Linkage):
         except TypeError:
             self.link_maxaccels = tuple(link_maxaccels for _ in self.links)
 
-        if link_angles is None:
-            self.angles = [0.0 for _ in self.links]
-        else:
-            self.angles = list(link_angles)
-            assert len(link_angles) == len(self.links)
-        
+        self._angles = np.zeros(len(self.links))
+        self._angles_view = self._angles.view()
+        self._angles_view.flags.writeable = False
+        self._absolute_angles = None
+        self._points = None
+
+        if link_angles is not None:
+            self.set_angles(link_angles)
+
+    @property
+    def angles(self) -> np.ndarray:
+        """Read only view of the link angles. Use set_angles / move_angles to change them."""
+        return self._angles_view
+
+    @angles.setter
+    def angles(self, angles: Iterable[float]):
+        self.set_angles(angles)
     
     def is_closed(self) -> bool:
-        x, y = OpenLinkage.Helpers.get_last(self.endpoints())
+        x, y = self.last_endpoint()
         return x*x + y*y < OpenLinkage.EQUALITY_THRESHOLD_SQUARED 
 
     def draw(self, ax: Axes, prev: Sequence[Line2D] = None, offset: Tuple[float, float] = (0.0, 0.0), draw_range_circ = False) -> Sequence[Artist]:
-        # https://www.geeksforgeeks.org/python-unzip-a-list-of-tuples/
-        x_cords, y_cords = tuple(zip(*self.endpoints(offset)))
+        points = self.endpoints(offset)
+        x_cords, y_cords = points[:, 0], points[:, 1]
 
         toReturn = prev if prev is not None else []
         
@@ -82,33 +101,60 @@ class OpenLinkage(Linkage):
     def links_sequence(self):
         return zip(self.links, self.angles)
 
-    def absolute_angles(self):
-        return np.cumsum(self.angles)
+    def absolute_angles(self) -> np.ndarray:
+        if self._absolute_angles is None:
+            self._absolute_angles = np.cumsum(self._angles)
+            self._absolute_angles.flags.writeable = False
+        return self._absolute_angles
 
     def _record_history(self):
         self.angle_history.append(np.array(self.angles))
 
+    def _angles_changed(self):
+        self._absolute_angles = None
+        self._points = None
+
     def set_angles(self, angles: Iterable[float]):
         assert len(angles) == len(self.links)
-        self.angles = list(angles)
+        self._angles[:] = angles
+        self._angles_changed()
 
     def move_angles(self, angle_changes: Iterable[float]):
-        assert len(angle_changes) == len(self.angles)
-        for i in range(len(angle_changes)):
-            self.angles[i] += angle_changes[i]
-
-    def endpoints(self, origin: Tuple[float, float] = (0.0, 0.0), start_angle=0.0) -> Generator[Tuple[float, float], None, None]:
-        x, y = origin
-        ang = start_angle
-        yield x, y
-        for l, theta in self.links_sequence():
-            ang += theta
-            x += math.cos(ang) * l
-            y += math.sin(ang) * l
-            yield np.array((x, y))
-
-    def last_endpoint(self):
-        return OpenLinkage.Helpers.get_last(self.endpoints())
+        assert len(angle_changes) == len(self._angles)
+        self._angles += angle_changes
+        self._angles_changed()
+
+    def endpoints(self, origin: Tuple[float, float] = (0.0, 0.0), start_angle=0.0) -> np.ndarray:
+        """Positions of every joint, starting with the origin.
+
+        Returns:
+            np.ndarray: (link_count + 1, 2) array of joint positions. Read
+                only, as it may be shared with later calls.
+        """
+        if start_angle != 0.0:
+            return OpenLinkage.Helpers.forward_kinematics(self._link_array, self._angles, origin, start_angle)
+
+        if self._points is None:
+            self._points = OpenLinkage.Helpers.forward_kinematics(self._link_array, self._angles)
+            self._points.flags.writeable = False
+
+        ox, oy = origin
+        if ox == 0 and oy == 0:
+            return self._points
+        return self._points + (ox, oy)
+
+    def last_endpoint(self) -> np.ndarray:
+        return self.endpoints()[-1]
+
+    def jacobian(self, points: Union[np.ndarray, None] = None) -> np.ndarray:
+        """2 x link_count jacobian of the end effector w.r.t. the link angles.
+
+        Args:
+            points: joint positions from endpoints(), if already computed
+        """
+        if points is None:
+            points = self.endpoints()
+        return OpenLinkage.Helpers.jacobian(points)
 
     def get_plot_bounds(self) -> Tuple[float, float, float, float]:
         buffer_percent = 0.02
@@ -159,10 +205,67 @@ class OpenLinkage(Linkage):
         def dist(p1: np.array, p2: np.array):
             return np.linalg.norm(p1 - p2)
 
+        @staticmethod
+        def nearest_angle(angle: float, reference: float) -> float:
+            """Shifts angle by a multiple of 2 pi to be within pi of reference"""
+            return reference + (angle - reference + math.pi) % (2 * math.pi) - math.pi
+
+        @staticmethod
+        def forward_kinematics(
+            links: Union[Sequence[float], np.ndarray],
+            angles: Union[Sequence[float], np.ndarray],
+            origin: Tuple[float, float] = (0.0, 0.0),
+            start_angle: float = 0.0
+        ) -> np.ndarray:
+            """Computes the joint positions of a chain in one vectorized pass.
+
+            Args:
+                links: (..., n) link lengths
+                angles: (..., n) relative link angles
+                origin: position of the base joint
+                start_angle: absolute angle the first link is measured from
+
+            Returns:
+                np.ndarray: (..., n + 1, 2) joint positions, origin first
+            """
+            links = np.asarray(links, float)
+            abs_angles = np.cumsum(angles, axis=-1) + start_angle
+            shape = np.broadcast(links, abs_angles).shape
+
+            points = np.empty(shape[:-1] + (shape[-1] + 1, 2))
+            points[..., 0, :] = origin
+            np.cumsum(links * np.cos(abs_angles), axis=-1, out=points[..., 1:, 0])
+            np.cumsum(links * np.sin(abs_angles), axis=-1, out=points[..., 1:, 1])
+            points[..., 1:, :] += points[..., :1, :]
+            return points
+
+        @staticmethod
+        def jacobian(points: np.ndarray) -> np.ndarray:
+            """Computes the planar end effector jacobian from joint positions.
+
+            Rotating link i moves the end effector perpendicular to the vector
+            from joint i to the end effector, so column i of the jacobian is
+            that vector (the suffix sum of the link vectors) rotated by 90 degrees.
+
+            Args:
+                points: (..., n + 1, 2) joint positions, as from forward_kinematics
+
+            Returns:
+                np.ndarray: (..., 2, n) jacobian
+            """
+            offsets = points[..., -1:, :] - points[..., :-1, :]
+            jacobian = np.empty(offsets.shape[:-2] + (2, offsets.shape[-2]))
+            np.negative(offsets[..., 1], out=jacobian[..., 0, :])
+            jacobian[..., 1, :] = offsets[..., 0]
+            return jacobian
+
 class OpenLinkageTrajectory(LinkageTrajectory):
     
     def push_state(self, angles: Iterable[float]):
-        self.states.append(np.array(angles))
+        if isinstance(self.states, np.ndarray):
+            # States solved offline are stored as one (M, link_count) array
+            self.states = list(self.states)
+        self.states.append(np.array(angles, float))
     
     def push_cur_state(self, linkage: OpenLinkage):
         self.push_state(linkage.angles)
@@ -175,12 +278,21 @@ if __name__ == "__main__":
 
     open_linkage = OpenLinkage([1, 1, 1], [0, math.pi / 2, -math.pi / 2])
     assert not open_linkage.is_closed()
-    assert list(open_linkage.endpoints()) == [
+    assert np.allclose(open_linkage.endpoints(), [
         (0, 0),
         (1, 0),
         (1, 1),
         (2, 1)
-    ]
+    ])
+    assert np.allclose(open_linkage.last_endpoint(), (2, 1))
+    assert np.allclose(open_linkage.endpoints((1, 2))[-1], (3, 3))
+
+    # Cached positions follow mutations
+    open_linkage.move_angles([0, 0, math.pi / 2])
+    assert np.allclose(open_linkage.last_endpoint(), (1, 2))
+    open_linkage.set_angles([math.pi / 2, 0, 0])
+    assert np.allclose(open_linkage.last_endpoint(), (0, 3))
+    assert np.allclose(open_linkage.absolute_angles(), [math.pi / 2] * 3)
 
     
     
\ No newline at end of file
@@ -0,0 +1,156 @@
+from typing import *
+
+import math
+import numpy as np
+import matplotlib.collections
+from matplotlib.artist import Artist
+from matplotlib.axes import Axes
+
+from .Linkage import Linkage
+from .OpenLinkage import OpenLinkage
+
+class OpenLinkageBatch(Linkage):
+    """An ensemble of open linkages with the same link count, stored as
+    (batch, links) arrays so that the whole ensemble can be stepped with
+    single numpy calls.
+    """
+
+    def __init__(
+        self,
+        link_sizes: Union[Sequence[float], np.ndarray],
+        link_angles: Union[Sequence[float], np.ndarray, None] = None,
+        link_minangles: Union[float, Sequence[float], np.ndarray] = -math.inf,
+        link_maxangles: Union[float, Sequence[float], np.ndarray] = math.inf,
+        batch_size: Union[int, None] = None,
+    ) -> None:
+        """Create a batch of linkages.
+
+        Args:
+            link_sizes: (batch, links) link lengths, or (links,) to share one
+                design across the batch
+            link_angles: (batch, links) or (links,) angles. Defaults to zeros.
+            link_minangles: scalar, (links,) or (batch, links) lower limits
+            link_maxangles: scalar, (links,) or (batch, links) upper limits
+            batch_size: number of linkages. Inferred from the 2D inputs if omitted.
+        """
+        links = np.asarray(link_sizes, float)
+        angles = np.zeros(links.shape[-1]) if link_angles is None else np.asarray(link_angles, float)
+        assert links.shape[-1] > 0
+        assert angles.shape[-1] == links.shape[-1]
+
+        if batch_size is None:
+            batch_size = max(
+                arr.shape[0] if arr.ndim == 2 else 1
+                for arr in (links, angles, np.asarray(link_minangles), np.asarray(link_maxangles))
+            )
+        shape = (batch_size, links.shape[-1])
+
+        self.links = np.array(np.broadcast_to(links, shape))
+        self.angles = np.array(np.broadcast_to(angles, shape))
+        self.link_minangles = np.array(np.broadcast_to(np.asarray(link_minangles, float), shape))
+        self.link_maxangles = np.array(np.broadcast_to(np.asarray(link_maxangles, float), shape))
+
+    @classmethod
+    def from_linkages(cls, linkages: Sequence[OpenLinkage]) -> "OpenLinkageBatch":
+        return cls(
+            link_sizes=[l.links for l in linkages],
+            link_angles=[l.angles for l in linkages],
+            link_minangles=[l.link_minangles for l in linkages],
+            link_maxangles=[l.link_maxangles for l in linkages],
+        )
+
+    def linkage(self, index: int) -> OpenLinkage:
+        """Copies a single member of the batch out into an OpenLinkage"""
+        return OpenLinkage(
+            link_sizes=self.links[index],
+            link_angles=self.angles[index],
+            link_minangles=self.link_minangles[index],
+            link_maxangles=self.link_maxangles[index],
+        )
+
+    @property
+    def batch_size(self) -> int:
+        return self.angles.shape[0]
+
+    @property
+    def link_count(self) -> int:
+        return self.angles.shape[1]
+
+    @property
+    def length(self) -> np.ndarray:
+        return self.links.sum(axis=1)
+
+    def absolute_angles(self) -> np.ndarray:
+        return np.cumsum(self.angles, axis=1)
+
+    def set_angles(self, angles: np.ndarray):
+        self.angles[:] = angles
+
+    def move_angles(self, angle_changes: np.ndarray):
+        self.angles += angle_changes
+
+    def endpoints(self, origin: Tuple[float, float] = (0.0, 0.0)) -> np.ndarray:
+        """Joint positions of every linkage.
+
+        Returns:
+            np.ndarray: (batch, links + 1, 2) joint positions
+        """
+        return OpenLinkage.Helpers.forward_kinematics(self.links, self.angles, origin)
+
+    def last_endpoints(self) -> np.ndarray:
+        """(batch, 2) end effector positions"""
+        abs_angles = self.absolute_angles()
+        return np.stack((
+            np.einsum('ij,ij->i', self.links, np.cos(abs_angles)),
+            np.einsum('ij,ij->i', self.links, np.sin(abs_angles)),
+        ), axis=1)
+
+    def jacobian(self, points: Union[np.ndarray, None] = None) -> np.ndarray:
+        """End effector jacobian of every linkage.
+
+        Args:
+            points: joint positions from endpoints(), if already computed
+
+        Returns:
+            np.ndarray: (batch, 2, links) jacobians
+        """
+        if points is None:
+            points = self.endpoints()
+        return OpenLinkage.Helpers.jacobian(points)
+
+    def get_plot_bounds(self) -> Linkage.Bounds:
+        buffer_percent = 0.02
+        size = (1 + buffer_percent) * self.length.max()
+        return (-size, size, -size, size)
+
+    def draw(self, ax: Axes, prev: Sequence[Artist] = None, offset: Tuple[float, float] = (0.0, 0.0)) -> Sequence[Artist]:
+        segments = self.endpoints(offset)
+
+        if prev:
+            prev[0].set_segments(segments)
+            return prev
+
+        lines_coll = matplotlib.collections.LineCollection(segments)
+        ax.add_collection(lines_coll)
+        return [lines_coll]
+
+    def __str__(self) -> str:
+        return f"LinkageBatch: {self.batch_size} x {self.link_count} links"
+
+if __name__ == "__main__":
+
+    singles = [
+        OpenLinkage([1, 1, 1], [0, math.pi / 2, -math.pi / 2]),
+        OpenLinkage([2, 1, 0.5], [0.3, -0.2, 1.1]),
+    ]
+    batch = OpenLinkageBatch.from_linkages(singles)
+    assert batch.batch_size == 2 and batch.link_count == 3
+
+    for i, single in enumerate(singles):
+        assert np.allclose(batch.endpoints()[i], single.endpoints())
+        assert np.allclose(batch.last_endpoints()[i], single.last_endpoint())
+        assert np.allclose(batch.linkage(i).angles, single.angles)
+
+    shared = OpenLinkageBatch([1, 2], [[0, 0], [0, math.pi / 2]])
+    assert shared.links.shape == (2, 2)
+    assert np.allclose(shared.jacobian()[1], [[-2, -2], [1, 0]])
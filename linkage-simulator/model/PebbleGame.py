@@ -0,0 +1,162 @@
+from typing import List, Sequence, Set, Tuple, Union
+
+import numpy as np
+
+class PebbleGame:
+    """The (2, 3) pebble game for the generic rigidity of planar bar & joint
+    frameworks (Jacobs & Hendrickson, 1997).
+
+    Every node starts with two pebbles, one per degree of freedom. An edge is
+    independent if four pebbles can be gathered on its ends, in which case
+    one of them is spent to cover it. Covered edges are kept directed away
+    from the node whose pebble covers them, so pebbles can later be moved
+    back along them.
+    """
+
+    def __init__(self, node_count: int, edges: Sequence[Tuple[int, int]]) -> None:
+        """Play the game on a graph.
+
+        Args:
+            node_count (int): Number of nodes
+            edges: (i, j) node index pairs, e.g. the distance constraints
+        """
+        self.node_count = node_count
+        self.pebbles = [2] * node_count
+        # out_edges[u] holds v for every independent edge uv covered by u's pebble
+        self.out_edges: List[Set[int]] = [set() for _ in range(node_count)]
+        self.independent = [self._add_edge(u, v) for u, v in edges]
+
+    @property
+    def degrees_of_freedom(self) -> int:
+        """Free pebbles left, including the 3 rigid motions of each component"""
+        return sum(self.pebbles)
+
+    def _find_pebble(self, start: int, locked: Sequence[int], visited: Union[Set[int], None] = None) -> bool:
+        """Moves a free pebble onto start by reversing a path of covered
+        edges, never taking the free pebbles of locked nodes. Paths may
+        pass through them, as that leaves their pebble count unchanged.
+
+        Args:
+            visited (set, optional): Filled with the nodes the search reached
+
+        Returns:
+            bool: whether a pebble was found
+        """
+        if visited is None:
+            visited = set()
+        visited.add(start)
+
+        parents = {start: None}
+        stack = [start]
+        while stack:
+            node = stack.pop()
+            for neighbor in self.out_edges[node]:
+                if neighbor in visited:
+                    continue
+                visited.add(neighbor)
+                parents[neighbor] = node
+
+                if self.pebbles[neighbor] > 0 and neighbor not in locked:
+                    # The pebble found covers the last edge of the path, and
+                    # each pebble that frees up covers the edge before it
+                    self.pebbles[neighbor] -= 1
+                    while parents[neighbor] is not None:
+                        previous = parents[neighbor]
+                        self.out_edges[previous].remove(neighbor)
+                        self.out_edges[neighbor].add(previous)
+                        neighbor = previous
+                    self.pebbles[start] += 1
+                    return True
+
+                stack.append(neighbor)
+        return False
+
+    def _gather(self, node: int, count: int, locked: Sequence[int]) -> bool:
+        """Tries to get count free pebbles onto node"""
+        while self.pebbles[node] < count:
+            if not self._find_pebble(node, locked):
+                return False
+        return True
+
+    def _add_edge(self, u: int, v: int) -> bool:
+        self._gather(u, 2, (v,))
+        self._gather(v, 2, (u,))
+        if self.pebbles[u] + self.pebbles[v] < 4:
+            return False
+
+        self.pebbles[u] -= 1
+        self.out_edges[u].add(v)
+        return True
+
+    def rigid_clusters(self) -> List[np.ndarray]:
+        """Decomposes the graph into maximal rigid clusters.
+
+        Every independent edge ends up in exactly one cluster, and clusters
+        share at most one node. Single edges that aren't part of anything
+        larger are returned as two node clusters.
+
+        Returns:
+            List[np.ndarray]: sorted node indices of each cluster
+        """
+        neighbors: List[Set[int]] = [set() for _ in range(self.node_count)]
+        for u in range(self.node_count):
+            for v in self.out_edges[u]:
+                neighbors[u].add(v)
+                neighbors[v].add(u)
+
+        # Searches reverse edges, so iterate over a snapshot of them
+        edges = [(u, v) for u in range(self.node_count) for v in self.out_edges[u]]
+
+        clusters = []
+        in_cluster: Set[Tuple[int, int]] = set()
+        for u, v in edges:
+            if (min(u, v), max(u, v)) in in_cluster:
+                continue
+
+            # Pin the edge with three pebbles. Any node that can't then get a
+            # pebble has no motion left relative to it.
+            self._gather(u, 2, (v,))
+            self._gather(v, 1, (u,))
+
+            rigid = {u, v}
+            flexible = set()
+            frontier = list(neighbors[u] | neighbors[v])
+            while frontier:
+                node = frontier.pop()
+                if node in rigid or node in flexible:
+                    continue
+                visited = set()
+                if self.pebbles[node] > 0 or self._find_pebble(node, (u, v), visited):
+                    flexible.add(node)
+                else:
+                    # Everything a failed search reaches is rigid too
+                    for reached in visited - rigid:
+                        rigid.add(reached)
+                        frontier.extend(neighbors[reached])
+
+            in_cluster.update(
+                (a, b) for a in rigid for b in neighbors[a] if a < b and b in rigid
+            )
+            clusters.append(np.array(sorted(rigid)))
+        return clusters
+
+if __name__ == "__main__":
+
+    # A triangle is rigid
+    triangle = PebbleGame(3, [(0, 1), (1, 2), (2, 0)])
+    assert all(triangle.independent) and triangle.degrees_of_freedom == 3
+    assert [c.tolist() for c in triangle.rigid_clusters()] == [[0, 1, 2]]
+
+    # A square flexes, so each bar is its own cluster...
+    square = PebbleGame(4, [(0, 1), (1, 2), (2, 3), (3, 0)])
+    assert square.degrees_of_freedom == 4
+    assert sorted(c.tolist() for c in square.rigid_clusters()) == [[0, 1], [0, 3], [1, 2], [2, 3]]
+
+    # ...until it is braced. A second brace is redundant.
+    braced = PebbleGame(4, [(0, 1), (1, 2), (2, 3), (3, 0), (0, 2), (1, 3)])
+    assert braced.independent == [True] * 5 + [False]
+    assert [c.tolist() for c in braced.rigid_clusters()] == [[0, 1, 2, 3]]
+
+    # Two triangles hinged at node 2 are separate clusters sharing it
+    hinged = PebbleGame(5, [(0, 1), (1, 2), (2, 0), (2, 3), (3, 4), (4, 2)])
+    assert sorted(c.tolist() for c in hinged.rigid_clusters()) == [[0, 1, 2], [2, 3, 4]]
@@ -0,0 +1,308 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import astuple, dataclass, field
+from typing import Callable, Tuple, Union
+import copy
+import math
+import os
+import tempfile
+
+import numpy as np
+
+from .LinkageNetwork import LinkageNetwork
+from .MotionTracer import Driver, MotionTrace, MotionTracer
+
+# Scores a candidate from its resampled coupler curve & full trace
+Objective = Callable[[np.ndarray, MotionTrace], float]
+
+@dataclass
+class SweepResults:
+    """Results of a SynthesisSweep, memory mapped from the files in its
+    directory. Candidates still PENDING have NaN objectives & curves."""
+    directory: str
+    status: np.ndarray      # (K,) outcome of each candidate, see SynthesisSweep
+    objectives: np.ndarray  # (K,) objective value, NaN if not traced
+    curves: np.ndarray      # (K, samples, 2) coupler curves, evenly spaced along their length
+
+@dataclass
+class SynthesisSweep:
+    """Evaluates many candidate constraint lengths & fixed node locations for
+    one LinkageNetwork topology, across a pool of processes.
+
+    Each candidate is assembled starting from the network's nodes, its
+    motion traced with the tracer, and the coupler node's path scored by the
+    objective. Candidates are handed out in chunks. Results are written to
+    .npy files memory mapped by every process, so nothing is sent back
+    through the pool, and a sweep that is interrupted can be resumed by
+    running it again with the same directory.
+    """
+
+    # Candidate outcomes
+    PENDING = 0      # Not evaluated yet
+    CLOSED = 1       # Traced through a full cycle
+    OPEN = 2         # Traced, but the tracer stopped before the cycle closed
+    UNASSEMBLED = 3  # The constraints couldn't be satisfied
+    INVALID = 4      # Assembled, but without exactly one degree of freedom
+
+    network: LinkageNetwork     # Topology, and starting guess for assembly
+    driver: Driver
+    coupler: int                # Node whose path is the coupler curve
+    # Must be picklable, e.g. a module level function. Optional.
+    objective: Union[Objective, None] = None
+    tracer: MotionTracer = field(default_factory=MotionTracer)
+    samples: int = 128          # Points per resampled coupler curve
+    chunk_size: int = 64        # Candidates per work unit
+    processes: Union[int, None] = None  # Defaults to the CPU count; 1 runs in this process
+    assembly_iterations: int = 50
+
+    def run(
+        self,
+        lengths: np.ndarray,
+        anchors: Union[np.ndarray, None] = None,
+        directory: Union[str, None] = None
+    ) -> SweepResults:
+        """Evaluates the candidates not already done in directory.
+
+        Args:
+            lengths (np.ndarray): (K, C) distance constraint lengths
+            anchors (np.ndarray, optional): (K, F, 2) fixed constraint
+                locations. Defaults to the network's for every candidate.
+            directory (str, optional): Where the inputs & results are kept.
+                Defaults to a new temporary directory.
+
+        Returns:
+            SweepResults: results of every candidate
+        """
+        lengths = np.asarray(lengths, float)
+        count = len(lengths)
+        assert lengths.shape == (count, len(self.network.distance_lengths))
+        if anchors is None:
+            anchors = np.broadcast_to(self.network.fixed_locations, (count, *self.network.fixed_locations.shape))
+        anchors = np.asarray(anchors, float)
+        assert anchors.shape == (count, *self.network.fixed_locations.shape)
+
+        if directory is None:
+            directory = tempfile.mkdtemp(prefix="synthesis-sweep-")
+        results = self._open_results(directory, lengths, anchors)
+
+        pending = np.flatnonzero(results.status == SynthesisSweep.PENDING)
+        chunks = [pending[start:start + self.chunk_size] for start in range(0, len(pending), self.chunk_size)]
+
+        global _worker
+        if self.processes == 1:
+            _start_worker(self, directory)
+            try:
+                for chunk in chunks:
+                    _evaluate_chunk(chunk)
+            finally:
+                _worker = None
+        else:
+            with ProcessPoolExecutor(self.processes, initializer=_start_worker, initargs=(self, directory)) as pool:
+                for _ in pool.map(_evaluate_chunk, chunks):
+                    pass
+
+        return results
+
+    def evaluate(
+        self,
+        network: LinkageNetwork,
+        start: np.ndarray,
+        lengths: np.ndarray,
+        anchors: np.ndarray
+    ) -> Tuple[int, float, Union[np.ndarray, None]]:
+        """Evaluates one candidate on a network of the sweep's topology,
+        changing it in place.
+
+        Args:
+            start (np.ndarray): (N, 2) node positions to assemble from
+            lengths (np.ndarray): (C,) distance constraint lengths
+            anchors (np.ndarray): (F, 2) fixed constraint locations
+
+        Returns:
+            Tuple: outcome, objective value and (samples, 2) coupler curve
+        """
+        nodes = np.array(start, float)
+        nodes[network.fixed_indices] = anchors
+        network.nodes = nodes
+        network.distance_lengths[:] = lengths
+        network.fixed_locations[:] = anchors
+
+        network.rectify(tolerance=self.tracer.tolerance, max_iterations=self.assembly_iterations)
+        if not network.last_rectify.converged:
+            return SynthesisSweep.UNASSEMBLED, math.nan, None
+
+        try:
+            trace = self.tracer.trace(network, self.driver)
+        except ValueError:
+            return SynthesisSweep.INVALID, math.nan, None
+
+        curve = SynthesisSweep.resample(trace.paths[:, self.coupler], self.samples, trace.closed)
+        objective = math.nan if self.objective is None else float(self.objective(curve, trace))
+        return SynthesisSweep.CLOSED if trace.closed else SynthesisSweep.OPEN, objective, curve
+
+    @staticmethod
+    def resample(path: np.ndarray, samples: int, closed: bool) -> np.ndarray:
+        """Points evenly spaced along a path by length. A closed path also
+        runs from its last point back to its first."""
+        if closed:
+            path = np.concatenate((path, path[:1]))
+        steps = np.diff(path, axis=0)
+        along = np.concatenate(([0.0], np.cumsum(np.hypot(steps[:, 0], steps[:, 1]))))
+        if along[-1] == 0:
+            return np.repeat(path[:1], samples, axis=0)
+
+        targets = np.linspace(0, along[-1], samples, endpoint=not closed)
+        return np.stack([np.interp(targets, along, path[:, axis]) for axis in (0, 1)], axis=1)
+
+    def _settings(self) -> str:
+        """Fingerprint of everything besides the candidates & topology that
+        the results depend on: the driver, coupler, objective (by qualified
+        name), tracer & assembly settings"""
+        objective = None
+        if self.objective is not None:
+            objective = f"{self.objective.__module__}.{self.objective.__qualname__}"
+        return repr({
+            "driver": np.asarray(self.driver).tolist(),
+            "coupler": self.coupler,
+            "objective": objective,
+            "tracer": astuple(self.tracer),
+            "assembly_iterations": self.assembly_iterations,
+        })
+
+    def _open_results(self, directory: str, lengths: np.ndarray, anchors: np.ndarray) -> SweepResults:
+        """Opens the result files of a previous run with the same inputs, or
+        creates them. The inputs include the topology, starting nodes, curve
+        resolution & settings the results were computed with."""
+        os.makedirs(directory, exist_ok=True)
+        count = len(lengths)
+        shapes = {
+            "status": ((count,), np.int8, SynthesisSweep.PENDING),
+            "objectives": ((count,), float, np.nan),
+            "curves": ((count, self.samples, 2), float, np.nan),
+        }
+
+        inputs = {
+            "lengths": lengths,
+            "anchors": anchors,
+            "distance_indices": self.network.distance_indices,
+            "fixed_indices": self.network.fixed_indices,
+            "nodes": self.network.nodes,
+            "samples": np.array(self.samples),
+            "settings": np.array(self._settings()),
+        }
+        if all(os.path.exists(_path(directory, name)) for name in inputs):
+            for name, values in inputs.items():
+                if not np.array_equal(np.load(_path(directory, name), mmap_mode="r"), values):
+                    raise ValueError(f"{directory} holds a sweep over different {name}")
+            return _load_results(directory)
+
+        for name, (shape, dtype, initial) in shapes.items():
+            array = np.lib.format.open_memmap(_path(directory, name), mode="w+", dtype=dtype, shape=shape)
+            array[:] = initial
+            array.flush()
+        # Inputs go last, marking the results as initialized
+        for name, values in inputs.items():
+            np.save(_path(directory, name), values)
+        return _load_results(directory)
+
+def _path(directory: str, name: str) -> str:
+    return os.path.join(directory, name + ".npy")
+
+def _load_results(directory: str) -> SweepResults:
+    return SweepResults(
+        directory=directory,
+        **{
+            name: np.lib.format.open_memmap(_path(directory, name), mode="r+")
+            for name in ("status", "objectives", "curves")
+        }
+    )
+
+# State of a sweep worker process: the sweep, its own copy of the network,
+# the starting node positions, the inputs and the results
+_worker = None
+
+def _start_worker(sweep: SynthesisSweep, directory: str):
+    global _worker
+    network = copy.deepcopy(sweep.network)
+    _worker = (
+        sweep,
+        network,
+        network.nodes.copy(),
+        np.load(_path(directory, "lengths"), mmap_mode="r"),
+        np.load(_path(directory, "anchors"), mmap_mode="r"),
+        _load_results(directory),
+    )
+
+def _evaluate_chunk(indices: np.ndarray):
+    sweep, network, start, lengths, anchors, results = _worker
+    for k in indices:
+        status, objective, curve = sweep.evaluate(network, start, lengths[k], anchors[k])
+        results.objectives[k] = objective
+        if curve is not None:
+            results.curves[k] = curve
+        # Status last, so an interrupted candidate is redone on resuming
+        results.status[k] = status
+
+    for array in (results.objectives, results.curves, results.status):
+        array.flush()
+
+if __name__ == "__main__":
+
+    def curve_area(curve, trace):
+        x, y = curve.T
+        return 0.5 * abs(np.dot(x, np.roll(y, 1)) - np.dot(y, np.roll(x, 1)))
+
+    # Crank-rocker with a coupler point, and variations of its lengths. Some
+    # of them can't assemble.
+    template = LinkageNetwork(
+        nodes=[(0, 0), (1, 0), (3.7097, 1.2844), (4, 0), (1.8549, 2.2)],
+        distance_constraints=[(0, 1, 1), (1, 2, 3), (2, 3, 3.5), (1, 4, 2), (2, 4, 2)],
+        fixed_constraints=[(0, (0, 0)), (3, (4, 0))],
+        bounds=(-2, 6, -3, 6)
+    )
+    template.rectify()
+    rng = np.random.default_rng(0)
+    lengths = template.distance_lengths * rng.uniform(0.7, 1.3, (24, 5))
+    lengths[0] = template.distance_lengths
+    lengths[1, 2] = 10
+    anchors = template.fixed_locations + rng.uniform(-0.2, 0.2, (24, 2, 2))
+
+    sweep = SynthesisSweep(template, driver=(0, 1), coupler=4, objective=curve_area, samples=64, chunk_size=5)
+    with tempfile.TemporaryDirectory() as directory:
+        serial = SynthesisSweep(**{**sweep.__dict__, "processes": 1}).run(lengths, anchors)
+        parallel = sweep.run(lengths, anchors, directory)
+        assert np.all(parallel.status != SynthesisSweep.PENDING)
+        assert parallel.status[0] == SynthesisSweep.CLOSED and parallel.status[1] == SynthesisSweep.UNASSEMBLED
+        assert np.array_equal(parallel.status, serial.status)
+        assert np.allclose(parallel.objectives, serial.objectives, equal_nan=True)
+        assert np.allclose(parallel.curves, serial.curves, equal_nan=True)
+
+        # Resuming only evaluates what was left pending
+        parallel.status[::3] = SynthesisSweep.PENDING
+        parallel.objectives[::3] = np.nan
+        resumed = sweep.run(lengths, anchors, directory)
+        assert np.array_equal(resumed.status, serial.status)
+        assert np.allclose(resumed.objectives, serial.objectives, equal_nan=True)
+
+        # Resuming with other inputs, a different topology, curve
+        # resolution or settings is refused
+        reversed_template = LinkageNetwork(
+            nodes=template.nodes,
+            distance_constraints=[(j, i, length) for i, j, length in template.distance_constraints],
+            fixed_constraints=template.fixed_constraints,
+            bounds=template.bounds
+        )
+        for mismatched, mismatched_lengths in (
+            (sweep, lengths * 2),
+            (SynthesisSweep(**{**sweep.__dict__, "samples": 32}), lengths),
+            (SynthesisSweep(**{**sweep.__dict__, "network": reversed_template}), lengths),
+            (SynthesisSweep(**{**sweep.__dict__, "driver": (3, 2)}), lengths),
+            (SynthesisSweep(**{**sweep.__dict__, "coupler": 2}), lengths),
+            (SynthesisSweep(**{**sweep.__dict__, "objective": None}), lengths),
+            (SynthesisSweep(**{**sweep.__dict__, "tracer": MotionTracer(step=0.1)}), lengths),
+            (SynthesisSweep(**{**sweep.__dict__, "assembly_iterations": 20}), lengths),
+        ):
+            try:
+                mismatched.run(mismatched_lengths, anchors, directory)
+                assert False
+            except ValueError:
+                pass
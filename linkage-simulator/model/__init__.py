@@ -1,6 +1,12 @@
 from typing import Union
 
 from .Linkage import Linkage, LinkageTrajectory
-from .OpenLinkage import OpenLinkage
-from .LinkageNetwork import LinkageNetwork
-
+from .OpenLinkage import OpenLinkage, OpenLinkageTrajectory
+from .OpenLinkageBatch import OpenLinkageBatch
+from .PebbleGame import PebbleGame
+from .FourBarLoop import FourBarLoop
+from .MotionTracer import MotionTracer, MotionTrace
+from .XPBDSolver import XPBDSolver
+from .LinkageNetwork import LinkageNetwork, ConstraintFactorization, SparseConstraintFactorization, ConstraintViolation
+from .SynthesisSweep import SynthesisSweep, SweepResults
+from .AssemblyModeSolver import AssemblyModeSolver, AssemblyModes
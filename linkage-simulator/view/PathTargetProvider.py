@@ -44,6 +44,20 @@ class PathTargetProvider(TargetProvider):
 
         self._target = self.points[-1]
         
+    def sample(self, times: np.ndarray) -> np.ndarray:
+        """Vectorized equivalent of update_target for many times at once.
+
+        Returns:
+            np.ndarray: (len(times), 2) targets
+        """
+        distances = (np.asarray(times) % 1) * self.len_total
+        cumulative_lengths = np.concatenate(((0,), np.cumsum(self.lengths)))
+        points = np.array(self.points, float)
+        return np.stack((
+            np.interp(distances, cumulative_lengths, points[:, 0]),
+            np.interp(distances, cumulative_lengths, points[:, 1]),
+        ), axis=1)
+
     @property
     def target(self):
         return self._target
@@ -57,6 +57,15 @@ class SplineTargetProvider(TargetProvider):
             for i in range(len(self._retarget_origins)):
                 self._retarget_trajectories[i] = xys * self._retarget_scales[i] + self._retarget_origins[i]
 
+    def sample(self, times: np.ndarray) -> np.ndarray:
+        """Vectorized equivalent of update_target for many times at once.
+
+        Returns:
+            np.ndarray: (len(times), 2) targets
+        """
+        assert self.is_valid()
+        return self.spline_fn(np.asarray(times) * len(self.targets_x))
+
     def get_full_trajectory(self):
         return self.target_trajectory
     